@@ -0,0 +1,137 @@
+import asyncio
+import collections
+import struct
+
+# Just enough of an MQTT 3.1.1 broker for the benchmarks: connect, subscribe with wildcards, retained
+# messages, QoS 0 delivery (QoS 1 publishes are acknowledged), ping and disconnect. Counts the
+# messages and bytes published on every topic.
+
+
+def topic_matches(pattern, topic):
+    pattern_parts = pattern.split('/')
+    topic_parts = topic.split('/')
+    for index, part in enumerate(pattern_parts):
+        if part == '#':
+            return True
+        if index >= len(topic_parts):
+            return False
+        if part != '+' and part != topic_parts[index]:
+            return False
+    return len(pattern_parts) == len(topic_parts)
+
+
+def encode_length(length):
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+
+class Broker:
+    def __init__(self):
+        self.sessions = {}
+        self.retained = {}
+        self.server = None
+        self.messages = collections.Counter()
+        self.bytes = collections.Counter()
+        # Last payload published on every topic
+        self.payloads = {}
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.server = await asyncio.start_server(self._serve, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        for writer in list(self.sessions):
+            writer.close()
+
+    def reset_counters(self):
+        self.messages.clear()
+        self.bytes.clear()
+
+    async def _read_packet(self, reader):
+        header = (await reader.readexactly(1))[0]
+        multiplier, length = 1, 0
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length += (byte & 0x7f) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        return header, await reader.readexactly(length) if length else b''
+
+    @staticmethod
+    def _publish_packet(topic, payload, retain):
+        encoded_topic = topic.encode()
+        body = struct.pack('>H', len(encoded_topic)) + encoded_topic + payload
+        return bytes((0x30 | (1 if retain else 0),)) + encode_length(len(body)) + body
+
+    def _route(self, topic, payload):
+        self.messages[topic] += 1
+        self.bytes[topic] += len(payload)
+        self.payloads[topic] = payload
+        packet = None
+        for writer, subscriptions in list(self.sessions.items()):
+            if any(topic_matches(pattern, topic) for pattern in subscriptions):
+                if packet is None:
+                    packet = self._publish_packet(topic, payload, False)
+                writer.write(packet)
+
+    def _subscribe(self, writer, subscriptions, body):
+        packet_id = body[:2]
+        offset = 2
+        patterns = []
+        while offset < len(body):
+            length = struct.unpack_from('>H', body, offset)[0]
+            patterns.append(body[offset + 2:offset + 2 + length].decode())
+            offset += 3 + length
+        subscriptions.update(patterns)
+        writer.write(b'\x90' + encode_length(2 + len(patterns)) + packet_id + bytes(len(patterns)))
+        for topic, payload in self.retained.items():
+            if any(topic_matches(pattern, topic) for pattern in patterns):
+                writer.write(self._publish_packet(topic, payload, True))
+
+    def _publish(self, writer, header, body):
+        qos = (header >> 1) & 3
+        topic_length = struct.unpack_from('>H', body)[0]
+        topic = body[2:2 + topic_length].decode()
+        offset = 2 + topic_length
+        if qos:
+            writer.write(b'\x40\x02' + body[offset:offset + 2])
+            offset += 2
+        payload = body[offset:]
+        if header & 1:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+        self._route(topic, payload)
+
+    async def _serve(self, reader, writer):
+        subscriptions = self.sessions[writer] = set()
+        try:
+            while True:
+                header, body = await self._read_packet(reader)
+                kind = header >> 4
+                if kind == 1:
+                    writer.write(b'\x20\x02\x00\x00')
+                elif kind == 3:
+                    self._publish(writer, header, body)
+                elif kind == 8:
+                    self._subscribe(writer, subscriptions, body)
+                elif kind == 10:
+                    writer.write(b'\xb0\x02' + body[:2])
+                elif kind == 12:
+                    writer.write(b'\xd0\x00')
+                elif kind == 14:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.sessions.pop(writer, None)
+            writer.close()
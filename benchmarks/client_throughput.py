@@ -0,0 +1,57 @@
+import asyncio
+import time
+from simplerobot.client import Robot
+from simplerobot.asyncclient import AsyncRobot
+
+# Needs srcontroller.py running against the broker in SIMPLEROBOT_MQTT_HOST
+
+
+def threaded(count):
+    robot = Robot()
+    robot.connect()
+    servo = robot.servos['camera']
+    started = time.perf_counter()
+    for index in range(count):
+        servo.move_to(servo.angle_min + index % 2, 90)
+        robot.update_servos()
+    return count / (time.perf_counter() - started)
+
+
+async def asynchronous(count):
+    async with AsyncRobot() as robot:
+        servo = robot.servos['camera']
+        started = time.perf_counter()
+        for index in range(count):
+            servo.move_to(servo.angle_min + index % 2, 90)
+            await robot.update_servos()
+        sequential = count / (time.perf_counter() - started)
+
+        # Pipelined: every command is in flight before the first acknowledgement is awaited
+        started = time.perf_counter()
+        commands = []
+        for index in range(count):
+            servo.move_to(servo.angle_min + index % 2, 90)
+            commands.append(await robot.update_servos(wait=False))
+        latencies = [await command for command in commands]
+        pipelined = count / (time.perf_counter() - started)
+
+        # Commands without an acknowledgement only wait for the publish
+        started = time.perf_counter()
+        for index in range(count):
+            robot.motors['left'].set_speed(index % 2)
+            await robot.update_motors()
+        await robot.stop()
+        motors = count / (time.perf_counter() - started)
+    return sequential, pipelined, max(latencies), motors
+
+
+def main(count=500):
+    print(f'threaded servo commands  {threaded(count):10.1f} /s')
+    sequential, pipelined, latency, motors = asyncio.run(asynchronous(count))
+    print(f'asyncio servo commands   {sequential:10.1f} /s')
+    print(f'pipelined servo commands {pipelined:10.1f} /s, max round trip {latency * 1000:.1f} ms')
+    print(f'asyncio motor commands   {motors:10.1f} /s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import timeit
+from simplerobot import utils
+from simplerobot.codec import JSONCodec, StructCodec
+
+
+def sample_messages(config):
+    servos = {servo['name']: dict(state='move', angle=12, target_angle=45, speed=0.5,
+                                  angle_min=servo['angle']['min'], angle_max=servo['angle']['max'])
+              for servo in config['servos'].values()}
+    return {
+        'servos': servos,
+        'motors': {motor['name']: {'speed': 100.0} for motor in config['motors']},
+        'distancesensors': {name: {'distance': 0.4567} for name in config['distancesensors']},
+        'linesensors': {name: {'line': 1} for name in config['linesensors']},
+        'leds': {'brightness': 255, 'leds': {name: dict(red=255, green=128, blue=0)
+                                              for name in config['leds']['names'].values()}},
+        'magnetometers': {name: dict(x=-12.5, y=33.75, z=-40.1) for name in config['magnetometers']},
+        'accelerometers': {name: dict(x=0.12, y=-0.3, z=9.81) for name in config['accelerometers']},
+    }
+
+
+def main(number=20000):
+    config = utils.load("config/robot.yaml")
+    codecs = (JSONCodec(), StructCodec.from_config(config))
+    print(f'{"area":16} {"codec":7} {"bytes":>6} {"encode us":>10} {"decode us":>10}')
+    for area, message in sample_messages(config).items():
+        for codec in codecs:
+            payload = codec.encode(area, message)
+            encode = timeit.timeit(lambda: codec.encode(area, message), number=number) / number * 1e6
+            decode = timeit.timeit(lambda: codec.decode(area, payload), number=number) / number * 1e6
+            print(f'{area:16} {codec.name:7} {len(payload):6} {encode:10.2f} {decode:10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import json
+import os
+import time
+from benchmarks.broker import Broker
+from benchmarks.end_to_end import LoopThread, summary
+from simplerobot import utils
+from simplerobot.client import Robot
+from simplerobot.clock import REAL_TIME
+from simplerobot.mqtt import ControllerHost
+from simplerobot.simulation import CONTROLLERS, World, install
+
+# Connect time and the messages a client then handles per second, by the areas it subscribes to.
+# Runs the controllers on simulated hardware against the broker stand-in.
+
+AREAS = (None, ['motors'], ['motors', 'distance_sensors'], ['magnetometers', 'accelerometers'])
+
+
+def measure(areas, count, window):
+    connects = []
+    for _ in range(count):
+        robot = Robot(areas=areas)
+        started = time.perf_counter()
+        robot.connect()
+        connects.append(time.perf_counter() - started)
+        robot._client.loop_stop()
+        robot._client.disconnect()
+
+    robot = Robot(areas=areas, metrics='connect')
+    robot.connect()
+    robot.metrics.snapshot(reset=True)
+    time.sleep(window)
+    handled = sum(histogram['count'] for histogram in robot.metrics.snapshot()['histograms'].values())
+    robot._client.loop_stop()
+    robot._client.disconnect()
+    return dict(areas='all' if areas is None else areas, connect_ms=summary(connects),
+                messages_per_s=handled / window)
+
+
+def main(count=20, window=2.0):
+    config = utils.load("config/robot.yaml")
+    broker = Broker()
+    port = LoopThread('broker').submit(broker.start()).result()
+    os.environ['SIMPLEROBOT_MQTT_HOST'] = f'mqtt://127.0.0.1:{port}'
+    controllers = [ctrl(config) for ctrl in CONTROLLERS]
+    world = World(REAL_TIME)
+    for controller in controllers:
+        install(controller, config, world)
+    LoopThread('controllers').submit(ControllerHost(controllers).run())
+    while len(broker.retained) < len(controllers):
+        time.sleep(0.01)
+
+    for areas in AREAS:
+        print(json.dumps(measure(areas, count, window)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import asyncio
+import json
+import resource
+import subprocess
+import sys
+import time
+from simplerobot import utils
+from simplerobot.controllers import *
+from simplerobot.mqtt import ControllerHost
+
+CONTROLLERS = (MotorController, ServoController, DistanceSensorController, LEDController, LineSensorController,
+               MagnetometerController, AccelerometerController)
+
+
+async def run(mode, duration, timeout=10.0):
+    config = utils.load("config/robot.yaml")
+    controllers = [ctrl(config) for ctrl in CONTROLLERS]
+    started = time.perf_counter()
+    if mode == 'shared':
+        tasks = [asyncio.create_task(ControllerHost(controllers).run())]
+    else:
+        tasks = [asyncio.create_task(controller.start()) for controller in controllers]
+    while any(controller.transport is None for controller in controllers):
+        for task in tasks:
+            if task.done():
+                # Raises e.g. the error connecting to the broker
+                task.result()
+        if time.perf_counter() - started > timeout:
+            raise TimeoutError('The controllers did not connect, is a broker running at SIMPLEROBOT_MQTT_HOST?')
+        await asyncio.sleep(0.001)
+    startup = time.perf_counter() - started
+
+    cpu = time.process_time()
+    await asyncio.sleep(duration)
+    cpu = time.process_time() - cpu
+    return dict(mode=mode, startup_s=startup, cpu_s=cpu, duration_s=duration,
+                max_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def main(duration=10):
+    # Every mode runs in its own process so memory use is not shared between them
+    for mode in ('separate', 'shared'):
+        output = subprocess.run([sys.executable, '-m', 'benchmarks.connections', mode, str(duration)],
+                                stdout=subprocess.PIPE, text=True, check=True).stdout
+        print(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        print(json.dumps(asyncio.run(run(sys.argv[1], float(sys.argv[2])))))
+    else:
+        main()
@@ -0,0 +1,194 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+import types
+from benchmarks.broker import Broker
+from simplerobot import utils
+from simplerobot.client import Robot
+from simplerobot.clock import REAL_TIME
+from simplerobot.codec import get_codec
+from simplerobot.mqtt import ControllerHost
+from simplerobot.simulation import CONTROLLERS, World, install
+
+# The controllers of srcontroller against a broker stand-in on localhost, driven by a threaded Robot.
+# Prints one JSON document on stdout, e.g.
+#
+#   python -m benchmarks.end_to_end --output results.json
+#
+# By default the controllers run on simulated hardware, so the sensors produce changing readings
+# anywhere. --hardware keeps the real drivers, to run on the robot itself.
+
+
+def summary(values, scale=1000.0):
+    # Milliseconds by default
+    values = sorted(values)
+    if not values:
+        return dict(count=0)
+
+    def percentile(fraction):
+        return values[min(int(len(values) * fraction), len(values) - 1)] * scale
+
+    return dict(count=len(values), mean=statistics.mean(values) * scale, p50=percentile(0.5),
+                p90=percentile(0.9), p99=percentile(0.99), max=values[-1] * scale)
+
+
+class LoopThread:
+    def __init__(self, name):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name=name, daemon=True).start()
+
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def call(self, function, timeout=5.0):
+        async def call():
+            return function()
+        return self.submit(call()).result(timeout)
+
+
+class LagProbe:
+    """How late the loop wakes up a task that sleeps for `interval`."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.lags = []
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(loop.time() - expected)
+
+    def take(self):
+        lags, self.lags = self.lags, []
+        return lags
+
+
+def round_trips(robot, area, count):
+    led = next(iter(robot.leds))
+    latencies = []
+    for index in range(count):
+        if area == 'motors':
+            robot.motors['left'].set_speed(index % 2 * 50)
+            command = robot.update_motors()
+        elif area == 'servos':
+            robot.servos['camera'].move_to(-(index % 2), 90)
+            command = robot.update_servos(wait=False)
+        else:
+            robot.leds[led].set_color(index % 256, 0, 0)
+            command = robot.update_leds()
+        latencies.append(command.wait())
+    return summary(latencies)
+
+
+def sensor_rates(broker, window):
+    rates = {}
+    for topic, messages in broker.messages.items():
+        _, area, kind = topic.split('/')
+        if kind in ('state', 'stream') and area not in ('motors', 'servos', 'leds'):
+            size = broker.bytes[topic]
+            rates[f'{area}/{kind}'] = dict(messages_per_s=messages / window, bytes_per_s=size / window,
+                                           bytes_per_message=size / messages)
+    return rates
+
+
+def parse_cost(config, retained, payloads, repeat):
+    # Microseconds per call of Robot._on_message, for the last state message of every area. Those may
+    # be deltas, the retained full states come first.
+    robot = Robot(codec=get_codec(config), observers='sync')
+    for topic, payload in retained.items():
+        robot._on_message(None, None, types.SimpleNamespace(topic=topic, payload=payload))
+    costs = {}
+    for topic, payload in sorted(payloads.items()):
+        if not topic.endswith('/state'):
+            continue
+        message = types.SimpleNamespace(topic=topic, payload=payload)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            robot._on_message(None, None, message)
+        costs[topic.split('/')[1]] = dict(us_per_message=(time.perf_counter() - started) / repeat * 1e6,
+                                          payload_bytes=len(payload))
+    return costs
+
+
+def run(count, window, hardware):
+    config = utils.load("config/robot.yaml")
+    broker = Broker()
+    broker_thread = LoopThread('broker')
+    port = broker_thread.submit(broker.start()).result()
+    os.environ['SIMPLEROBOT_MQTT_HOST'] = f'mqtt://127.0.0.1:{port}'
+
+    controllers = [ctrl(config) for ctrl in CONTROLLERS]
+    if not hardware:
+        world = World(REAL_TIME)
+        for controller in controllers:
+            install(controller, config, world)
+    host = ControllerHost(controllers)
+    controller_thread = LoopThread('controllers')
+    controller_thread.submit(host.run())
+    probe = LagProbe()
+    controller_thread.submit(probe.run())
+
+    robot = Robot(codec=get_codec(config))
+    started = time.perf_counter()
+    robot.connect()
+    connect_time = time.perf_counter() - started
+
+    # Sensors only, with the robot turning on the spot so the magnetometer readings move
+    robot.rotate_right(50)
+    probe.take()
+    broker_thread.call(broker.reset_counters)
+    time.sleep(window)
+    sensors = broker_thread.call(lambda: sensor_rates(broker, window))
+    idle_lag = probe.take()
+    robot.stop().wait()
+
+    commands = {area: round_trips(robot, area, count) for area in ('motors', 'servos', 'leds')}
+    load_lag = probe.take()
+    payloads = broker_thread.call(lambda: dict(broker.payloads))
+    retained = broker_thread.call(lambda: dict(broker.retained))
+
+    robot._client.loop_stop()
+    robot._client.disconnect()
+    return dict(
+        environment=dict(python=platform.python_version(), machine=platform.machine(), codec=robot._codec.name,
+                         hardware='real' if hardware else 'simulated', time=time.time()),
+        connect_ms=connect_time * 1000,
+        round_trip_ms=commands,
+        sensors=sensors,
+        on_message=parse_cost(config, retained, payloads, 2000),
+        loop_lag_ms=dict(sensors=summary(idle_lag), commands=summary(load_lag)),
+        scheduler=host.scheduler.statistics())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End to end latency and throughput of the controllers and client')
+    parser.add_argument('--count', type=int, default=500, help='commands per area')
+    parser.add_argument('--window', type=float, default=3.0, help='seconds to measure the sensors over')
+    parser.add_argument('--codec', choices=('json', 'binary'), help='overrides the codec in the configuration')
+    parser.add_argument('--hardware', action='store_true', help='use the real drivers instead of simulated hardware')
+    parser.add_argument('--output', help='also write the results to this file')
+    arguments = parser.parse_args()
+    if arguments.codec:
+        os.environ['SIMPLEROBOT_CODEC'] = arguments.codec
+
+    # Anything the controllers print goes to stderr, stdout only carries the results
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run(arguments.count, arguments.window, arguments.hardware)
+    document = json.dumps(results, indent=2)
+    print(document)
+    if arguments.output:
+        with open(arguments.output, 'w') as f:
+            f.write(document)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+import random
+import timeit
+from simplerobot.utils import MovingAverage, FilterBank
+
+
+def main(number=20000, window_size=10):
+    samples = [(random.gauss(20, 2), random.gauss(-5, 2), random.gauss(40, 2)) for _ in range(number)]
+
+    averages = {axis: MovingAverage(window_size) for axis in 'xyz'}
+
+    def moving_average():
+        for x, y, z in samples:
+            averages['x'].add(x)
+            averages['y'].add(y)
+            averages['z'].add(z)
+            averages['x'].average, averages['y'].average
+
+    print(f'{"MovingAverage x3":24} {timeit.timeit(moving_average, number=1) / number * 1e6:8.2f} us/update')
+    for mode, kwargs in (('mean', {}), ('ema', {}), ('median', {}), ('median', dict(outlier_threshold=3))):
+        bank = FilterBank(3, window_size, mode, **kwargs)
+
+        def filter_bank():
+            for sample in samples:
+                bank.add(sample)
+                bank.value[0], bank.value[1]
+
+        label = f'FilterBank {mode}' + (' outliers' if kwargs else '')
+        print(f'{label:24} {timeit.timeit(filter_bank, number=1) / number * 1e6:8.2f} us/update')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import threading
+import time
+import tracemalloc
+from benchmarks.broker import Broker
+from benchmarks.end_to_end import summary
+from simplerobot import utils
+from simplerobot.client import Robot
+from simplerobot.fleet import Fleet
+from simplerobot.simulation import Simulation
+
+# Memory and CPU per robot of one Fleet connection against one Robot connection per robot, by the
+# number of robots, e.g.
+#
+#   python -m benchmarks.fleet --sizes 1 10 50
+#
+# A stand-in runs in a process of its own: a broker that publishes the state of every robot, with
+# the distance sensor, magnetometer and accelerometer changing at their configured rates, and that
+# acknowledges control messages the way the controllers do. The measured process only runs the clients.
+
+SENSORS = ('distancesensors', 'magnetometers', 'accelerometers')
+
+
+class FleetStandIn(Broker):
+    def __init__(self, prefixes, states):
+        super().__init__()
+        self.prefixes = prefixes
+        for prefix in prefixes:
+            for area, state in states.items():
+                self.retained[f'{prefix}/{area}/state'] = json.dumps(state).encode()
+
+    def _route(self, topic, payload):
+        super()._route(topic, payload)
+        prefix, area, kind = topic.split('/')
+        if kind == 'ctrl':
+            message = json.loads(payload)
+            if '_id' in message:
+                super()._route(f'{prefix}/{area}/state', json.dumps({'_ack': message['_id']}).encode())
+
+    async def publish_sensors(self, config, rate):
+        names = {area: next(iter(config[area])) for area in SENSORS}
+        tick = 0
+        while True:
+            tick += 1
+            for index, prefix in enumerate(self.prefixes):
+                angle = tick / rate + index
+                self._route(f'{prefix}/distancesensors/state',
+                            json.dumps({names['distancesensors']: {'distance': 1 + math.sin(angle)}}).encode())
+                for area in ('magnetometers', 'accelerometers'):
+                    self._route(f'{prefix}/{area}/state', json.dumps(
+                        {names[area]: {'x': math.cos(angle), 'y': math.sin(angle), 'z': 0.5}}).encode())
+            await asyncio.sleep(1 / rate)
+
+
+def serve(count, ports):
+    config = utils.load("config/robot.yaml")
+    simulation = Simulation(config)
+    states = {controller.name: controller.state for controller in simulation.controllers}
+    simulation.close()
+
+    async def run():
+        broker = FleetStandIn([f'robot{index}' for index in range(count)], states)
+        ports.put(await broker.start())
+        await broker.publish_sensors(config, config['distancesensors'][next(iter(config['distancesensors']))]['rate'])
+
+    asyncio.run(run())
+
+
+def measure(mode, count, window):
+    ports = multiprocessing.Queue()
+    stand_in = multiprocessing.Process(target=serve, args=(count, ports), daemon=True)
+    stand_in.start()
+    url = f'mqtt://127.0.0.1:{ports.get()}'
+    prefixes = [f'robot{index}' for index in range(count)]
+    threads = threading.active_count()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    if mode == 'fleet':
+        fleet = Fleet(prefixes)
+        fleet.connect(url)
+        robots = list(fleet)
+    else:
+        robots = [Robot(prefix=prefix) for prefix in prefixes]
+        for robot in robots:
+            robot.connect(url)
+    connect_time = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    cpu = time.process_time()
+    time.sleep(window)
+    cpu = time.process_time() - cpu
+
+    latencies = []
+    for _ in range(20):
+        if mode == 'fleet':
+            latencies.extend(fleet.wait(fleet.broadcast('motors', {'left': 0, 'right': 0})).values())
+        else:
+            commands = [robot._send_command('motors', {'left': 0, 'right': 0}) for robot in robots]
+            latencies.extend(command.wait() for command in commands)
+
+    result = dict(mode=mode, robots=count, connect_ms=connect_time * 1000,
+                  threads_per_robot=(threading.active_count() - threads) / count,
+                  memory_kb_per_robot=memory / count / 1024, cpu_percent_per_robot=cpu / window / count * 100,
+                  broadcast_ms=summary(latencies))
+    if mode == 'fleet':
+        fleet.disconnect()
+    else:
+        for robot in robots:
+            robot._client.loop_stop()
+            robot._client.disconnect()
+    stand_in.terminate()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory and CPU per robot of a Fleet and of separate Robots')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 5, 10, 20, 50], help='numbers of robots')
+    parser.add_argument('--window', type=float, default=3.0, help='seconds to measure the CPU over')
+    parser.add_argument('--modes', nargs='+', choices=('fleet', 'robots'), default=['fleet', 'robots'])
+    arguments = parser.parse_args()
+    for count in arguments.sizes:
+        for mode in arguments.modes:
+            print(json.dumps(measure(mode, count, arguments.window)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+import asyncio
+import json
+import statistics
+import sys
+import threading
+from simplerobot import utils
+from simplerobot.client import Robot
+from simplerobot.controllers import *
+from simplerobot.mqtt import ControllerHost
+from simplerobot.transport import LocalTransport
+
+# Command to state round trip, MQTT against the in-process transport. The MQTT run needs a broker
+# in SIMPLEROBOT_MQTT_HOST, pass 'local' to only run the in-process one.
+
+CONTROLLERS = (MotorController, ServoController, DistanceSensorController, LEDController, LineSensorController,
+               MagnetometerController, AccelerometerController)
+
+
+def start_controllers(transport):
+    config = utils.load("config/robot.yaml")
+    host = ControllerHost([ctrl(config) for ctrl in CONTROLLERS], transport)
+    threading.Thread(target=asyncio.run, args=(host.run(),), daemon=True).start()
+
+
+def round_trips(transport, count):
+    start_controllers(transport)
+    robot = Robot(transport=transport)
+    robot.connect()
+    latencies = []
+    for index in range(count):
+        robot.motors['left'].set_speed(index % 100)
+        latencies.append(robot.update_motors().wait())
+    robot.stop()
+    if transport is not None:
+        transport.stop()
+    latencies.sort()
+    return dict(transport='mqtt' if transport is None else 'local', commands=count,
+                mean_ms=statistics.mean(latencies) * 1000, median_ms=latencies[count // 2] * 1000,
+                p99_ms=latencies[int(count * 0.99)] * 1000)
+
+
+def main(transports, count=2000):
+    for name in transports:
+        print(json.dumps(round_trips(LocalTransport() if name == 'local' else None, count)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or ['local', 'mqtt'])
@@ -1,16 +1,17 @@
-import time
 from simplerobot.client import Robot
 from simplerobot.compass import Compass
 
 
 class Explorer:
-    def __init__(self, robot):
+    def __init__(self, robot, store=None):
         self.robot = robot
-        self.compass = Compass(robot.magnetometers['body'])
+        self.clock = robot.clock
+        self.compass = Compass(robot.magnetometers['body'], robot.accelerometers['body'], store)
         self.state = 'init'
 
-    def run(self):
-        while True:
+    def run(self, duration=None):
+        end = None if duration is None else self.clock.monotonic() + duration
+        while end is None or self.clock.monotonic() < end:
             func = getattr(self, f'state_{self.state}')
             func()
 
@@ -24,31 +25,31 @@ class Explorer:
         robot.update_leds()
         robot.update_servos()
         robot.wait_for_servos()
-        self.state = 'calibrate'
+        # The calibration is kept on disk, only spin when there is none yet
+        self.state = 'forward' if self.compass.is_calibrated else 'calibrate'
 
     def state_calibrate(self):
         robot = self.robot
         compass = self.compass
         compass.calibration_start()
         robot.rotate_right(50)
+        # The progress on the LEDs as one effect: a pair of LEDs lights up every second
+        frames = []
         for second in range(12):
             level = ('bottom', 'top')[(second // 3) % 2]
             position = ('back', 'middle', 'front')[second % 3]
             color = ((255, 0, 0), (0, 255, 0))[second // 6]
-            for side in ('left', 'right'):
-                robot.leds[f'{side}_{level}_{position}'].set_color(*color)
-            robot.update_leds()
-            time.sleep(1)
+            frames.append(dict(t=second, leds={f'{side}_{level}_{position}': color for side in ('left', 'right')}))
+        robot.start_led_effect('keyframes', frames=frames, interpolate=False, duration=12)
+        self.clock.sleep(12)
         compass.calibration_finish()
         robot.stop()
         self.state = 'forward'
         print(f'Current bearing: {self.compass.bearing}')
 
     def state_forward(self):
-        self.state = None
-        while True:
-            print(f'Current bearing: {self.compass.bearing}')
-            time.sleep(0.5)
+        print(f'Current bearing: {self.compass.bearing}')
+        self.clock.sleep(0.5)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,223 @@
+import asyncio
+import contextlib
+import os
+import traceback
+import asyncio_mqtt
+from .client import (BaseRobot, Command, CommandTimeout, ConnectTimeout, AreaNotSubscribed,
+                     NamedCachedStateObjectCollection)
+from .utils import get_mqtt_connection_details
+from .clock import REAL_TIME
+
+
+class AsyncCommand(Command):
+    def __init__(self, command_id: int, area: str, timeout: float, clock=REAL_TIME):
+        super().__init__(command_id, area, timeout, clock)
+        self._future = asyncio.get_running_loop().create_future()
+
+    def acknowledged(self):
+        super().acknowledged()
+        if not self._future.done():
+            self._future.set_result(self.latency)
+
+    async def wait(self, timeout: float = None) -> float:
+        try:
+            return await asyncio.wait_for(asyncio.shield(self._future), self._remaining(timeout))
+        except asyncio.TimeoutError:
+            raise CommandTimeout(f'Command {self.id} to {self.area} was not acknowledged')
+
+    def __await__(self):
+        return self.wait().__await__()
+
+
+class AsyncRobot(BaseRobot):
+    """asyncio version of Robot: connect, the update methods and the waits are coroutines.
+
+        async with AsyncRobot() as robot:
+            await robot.forward()
+            async for state in robot.distance_sensors['front'].updates():
+                ...
+    """
+
+    command_class = AsyncCommand
+
+    def __init__(self, codec=None, history: dict = None, command_timeout: float = 5.0, observers='all',
+                 transport=None, clock=None, metrics: str = None, areas=None, prefix: str = None):
+        super().__init__(codec, history, command_timeout, observers, transport, clock, metrics, areas, prefix)
+        self._client = None
+        self._reader = None
+        self._metrics_task = None
+        self._exit_stack = None
+        self._initialised = asyncio.Event()
+        self._servos_event = asyncio.Event()
+        self._area_events = {}
+
+    async def connect(self, url=None, timeout: float = 10.0):
+        # Waits for the state of the areas passed on creation, see use for the others
+        if not self.pending_areas:
+            self._initialised.set()
+        if self.transport is not None:
+            self.transport.connect(self, asyncio.get_running_loop())
+            await self._wait_for_init(timeout)
+            return
+        if url is None:
+            url = os.environ.get('SIMPLEROBOT_MQTT_HOST', "mqtt://localhost")
+        host, kwargs = get_mqtt_connection_details(url)
+        self._exit_stack = contextlib.AsyncExitStack()
+        self._client = await self._exit_stack.enter_async_context(asyncio_mqtt.Client(host, **kwargs))
+        # Listen before subscribing so the retained state is not missed
+        messages = await self._exit_stack.enter_async_context(self._client.unfiltered_messages())
+        self._reader = asyncio.create_task(self._read(messages))
+        subscriptions = self.subscriptions
+        if subscriptions:
+            await self._client.subscribe([(topic, 0) for topic in subscriptions])
+        await self._wait_for_init(timeout)
+        if self.metrics is not None:
+            self._metrics_task = asyncio.create_task(self._publish_metrics())
+
+    async def _wait_for_init(self, timeout):
+        try:
+            await asyncio.wait_for(self._initialised.wait(), timeout)
+        except asyncio.TimeoutError:
+            raise ConnectTimeout(f'No state received for {", ".join(sorted(self.pending_areas))}')
+
+    def _activate(self, collection):
+        if self.transport is not None:
+            # In-process clients receive every area
+            self.areas.add(collection.area)
+            return
+        # Subscribing takes a round trip, which a collection access cannot wait for
+        area = collection.area
+        raise AreaNotSubscribed(f'{area} is not subscribed, pass it in areas or await use("{area}") first')
+
+    async def use(self, *areas, timeout: float = 10.0):
+        """Subscribes to areas that were not passed on creation and waits for their state, e.g.
+
+            robot = AsyncRobot(areas=['distance_sensors'])
+            await robot.connect()
+            await robot.use('motors')
+            await robot.forward()
+        """
+        areas = [BaseRobot.AREA_MAP.get(area, area) for area in areas]
+        for area in areas:
+            collection = getattr(self, area)
+            if isinstance(collection, NamedCachedStateObjectCollection):
+                collection.activate = None
+        # With all areas every state topic is subscribed to already
+        new = [] if self._all_areas else [area for area in areas if area not in self.areas]
+        self.areas.update(new)
+        waiting = [area for area in new if area not in self._areas_received]
+        if self._client is None or not waiting:
+            # Before connect the areas are subscribed to with the others
+            return
+        events = [self._area_events.setdefault(area, asyncio.Event()) for area in waiting]
+        await self._client.subscribe([(topic, 0) for area in waiting for topic in self._area_topics(area)])
+        try:
+            await asyncio.wait_for(asyncio.gather(*(event.wait() for event in events)), timeout)
+        except asyncio.TimeoutError:
+            raise ConnectTimeout(f'No state received for {", ".join(sorted(set(waiting) - self._areas_received))}')
+
+    def _area_received(self, area):
+        event = self._area_events.pop(area, None)
+        if event is not None:
+            event.set()
+
+    async def _publish_metrics(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            await self._publish(f'{self.topic_prefix}/{self.metrics_name}/metrics', self._metrics_message())
+
+    async def disconnect(self):
+        if self.transport is not None:
+            self.transport.disconnect(self)
+        for task in (self._reader, self._metrics_task):
+            if task is not None:
+                task.cancel()
+        self._reader = self._metrics_task = None
+        if self._exit_stack is not None:
+            await self._exit_stack.aclose()
+            self._exit_stack = None
+            self._client = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.disconnect()
+
+    async def _read(self, messages):
+        async for message in messages:
+            try:
+                self._process_message(message.topic, message.payload)
+            except Exception:
+                # A bad message must not end the reader
+                traceback.print_exc()
+
+    # The update methods return an AsyncCommand to await, or None when there was nothing to send
+
+    async def _send_command(self, area: str, message: dict):
+        if message:
+            if not self._all_areas and BaseRobot.AREA_MAP.get(area, area) not in self.areas:
+                # The ack arrives on the state topic of the area
+                await self.use(area)
+            command = self._create_command(area, message)
+            published = self._send_message(f"{area}/ctrl", message)
+            if published is not None:
+                await published
+            return command
+
+    async def update_leds(self, brightness=None):
+        return await self._send_command("leds", self._leds_message(brightness))
+
+    async def start_led_effect(self, effect, **spec):
+        return await self._send_command("leds", self._led_effect_message(effect, spec))
+
+    async def stop_led_effect(self):
+        return await self._send_command("leds", self._led_effect_message(None, {}))
+
+    async def set_rule(self, name, when, do, repeat=None):
+        return await self._send_command("rules", self._rule_message(name, when, do, repeat))
+
+    async def remove_rule(self, name):
+        return await self._send_command("rules", {name: None})
+
+    async def update_servos(self, synchronise=False, wait=True):
+        command = await self._send_command("servos", self._servos_message(synchronise))
+        if command is not None and wait:
+            await command
+        return command
+
+    async def wait_for_servos(self):
+        # Messages are handled on this loop, so nothing can change between the check and the wait
+        while any(servo.target_angle != servo.angle for servo in self.servos.values()):
+            self._servos_event.clear()
+            await self._servos_event.wait()
+
+    async def update_motors(self):
+        return await self._send_command("motors", self._create_message(self.motors))
+
+    async def update_magnetometers(self):
+        return await self._send_command("magnetometers", self._create_message(self.magnetometers))
+
+    async def update_accelerometers(self):
+        return await self._send_command("accelerometers", self._create_message(self.accelerometers))
+
+    async def wait_until(self, predicate, timeout: float = None) -> bool:
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        trigger = self.when(predicate, lambda: loop.call_soon_threadsafe(event.set), once=True)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            trigger.cancel()
+            return False
+
+    def _publish(self, topic: str, data: bytes):
+        return self._client.publish(topic, data)
+
+    def _init_complete(self):
+        self._initialised.set()
+
+    def _servos_updated(self):
+        self._servos_event.set()
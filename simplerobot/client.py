@@ -1,22 +1,109 @@
+import asyncio
 import json
 import os
+import random
 import threading
+import time
+import traceback
 from typing import Dict, Iterator
 from collections.abc import Mapping
-from .utils import get_mqtt_connection_details
+from .utils import get_mqtt_connection_details, merge_state, topic_prefix
+from .clock import REAL_TIME
+from .codec import JSONCodec
+from .stream import decode_frame_header
+from .history import History
+from .dispatch import ObserverDispatcher
+from .triggers import Trigger, TriggerIndex, record_access
+from .metrics import Metrics, DEFAULT_INTERVAL
+import numpy
 import paho.mqtt.client as mqtt
 
+FRAME_DTYPE = numpy.dtype([('t', '<f8'), ('xyz', '<f4', (3,))])
+
+
+class CommandTimeout(Exception):
+    pass
+
+
+class ConnectTimeout(Exception):
+    pass
+
+
+class AreaNotSubscribed(Exception):
+    pass
+
+
+class Command:
+    """Handle on a control message, completed when the controller acknowledges it."""
+
+    def __init__(self, command_id: int, area: str, timeout: float, clock=REAL_TIME):
+        self.id = command_id
+        self.area = area
+        self.timeout = timeout
+        self.clock = clock
+        self.sent = clock.monotonic()
+        self.latency = None
+        self._event = threading.Event()
+
+    @property
+    def done(self):
+        return self.latency is not None
+
+    @property
+    def expired(self):
+        return self.latency is None and self.clock.monotonic() - self.sent > self.timeout
+
+    def acknowledged(self):
+        self.latency = self.clock.monotonic() - self.sent
+        self._event.set()
+
+    def _remaining(self, timeout):
+        return max(self.timeout - (self.clock.monotonic() - self.sent) if timeout is None else timeout, 0)
+
+    def wait(self, timeout: float = None) -> float:
+        # Returns the round trip latency
+        if not self.clock.wait(self._event, self._remaining(timeout)):
+            raise CommandTimeout(f'Command {self.id} to {self.area} was not acknowledged')
+        return self.latency
+
 
 class CachedStateObject:
-    def __init__(self, state: dict):
+    # Numeric properties recorded when history is enabled, None for all properties
+    history_properties = None
+
+    def __init__(self, state: dict, name: str = None):
+        self.name = name
         self._state = state
         self._to_update_state = {}
         self._observers = []
+        self.history = None
+        self.dispatcher = None
+        # Timestamps the history, the clock of the robot
+        self.clock = REAL_TIME
+
+    def keep_history(self, size: int):
+        self.history = History(self.history_properties or self.properties, size)
+        self.history.append(self.clock.time(), self._state)
 
     def state_updated(self, state: dict):
-        self._state = state
-        for observer in self._observers:
-            observer(self)
+        # Controllers may publish only the properties that changed
+        self._state.update(state)
+        if self.history is not None:
+            self.history.append(self.clock.time(), self._state)
+        if not self._observers:
+            return
+        if self.dispatcher is None:
+            for observer in self._observers:
+                observer(self)
+        else:
+            self.dispatcher.submit(self, self.snapshot())
+
+    def snapshot(self):
+        # A copy that keeps the state of this update while the object itself moves on
+        snapshot = object.__new__(type(self))
+        snapshot.__dict__.update(self.__dict__)
+        snapshot._state = dict(self._state)
+        return snapshot
 
     def register(self, observer):
         self._observers.append(observer)
@@ -24,6 +111,27 @@ class CachedStateObject:
     def unregister(self, observer):
         self._observers.remove(observer)
 
+    async def updates(self, maxsize=100):
+        # Yields a copy of the state after every update, from any client. When the consumer falls
+        # more than maxsize updates behind, the oldest ones are dropped.
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize)
+
+        def put(state):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(state)
+
+        def observer(obj):
+            loop.call_soon_threadsafe(put, dict(obj._state))
+
+        self.register(observer)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.unregister(observer)
+
     @property
     def needs_update(self):
         return bool(self._to_update_state)
@@ -35,31 +143,66 @@ class CachedStateObject:
 
     def __getattr__(self, item):
         if item in self.properties:
+            record_access(self, item)
             return self._state[item]
         raise AttributeError(f'No attribute {item}')
 
 
 class NamedCachedStateObjectCollection(Mapping):
-    def __init__(self, state_class):
+    def __init__(self, state_class, history: int = None, dispatcher: ObserverDispatcher = None,
+                 triggers: TriggerIndex = None, area: str = None, clock=REAL_TIME):
         self.names_to_obj: Dict[str:CachedStateObject] = {}
+        self.clock = clock
         self.state_class = state_class
+        self.history = history
+        self.dispatcher = dispatcher
+        self.triggers = triggers
+        self.area = area
+        # Called with the collection on first use when its area is not subscribed yet
+        self.activate = None
+
+    def _use(self):
+        if self.activate is not None:
+            activate, self.activate = self.activate, None
+            try:
+                activate(self)
+            except Exception:
+                self.activate = activate
+                raise
+
+    def keep_history(self, size: int):
+        self.history = size
+        for obj in self.names_to_obj.values():
+            obj.keep_history(size)
 
     def __getitem__(self, key: str) -> CachedStateObject:
+        self._use()
         return self.names_to_obj[key]
 
     def __len__(self) -> int:
+        self._use()
         return len(self.names_to_obj)
 
     def __iter__(self) -> Iterator[str]:
+        self._use()
         return iter(self.names_to_obj)
 
     def update_from_message(self, message: dict):
+        received = time.monotonic()
+        changes = []
         for name, state in message.items():
             obj = self.names_to_obj.get(name)
             if obj is None:
-                self.names_to_obj[name] = self.state_class(state)
+                obj = self.names_to_obj[name] = self.state_class(state, name)
+                obj.dispatcher = self.dispatcher
+                obj.clock = self.clock
+                if self.history:
+                    obj.keep_history(self.history)
             else:
                 obj.state_updated(state)
+            changes.extend((obj, prop) for prop in state)
+        if self.triggers is not None:
+            self.triggers.updated(changes, received)
 
 
 class Led(CachedStateObject):
@@ -71,9 +214,10 @@ class Led(CachedStateObject):
 
 class Servo(CachedStateObject):
     properties = ('angle', 'target_angle', 'state', 'speed')
+    history_properties = ('angle', 'target_angle', 'speed')
 
-    def __init__(self, state: dict):
-        super().__init__(state)
+    def __init__(self, state: dict, name: str = None):
+        super().__init__(state, name)
         self.event = threading.Event()
 
     def move_to(self, angle, speed):
@@ -107,123 +251,452 @@ class LineSensor(CachedStateObject):
     properties = ('line', )
 
 
-class Magnetometer(CachedStateObject):
+class StreamingSensor(CachedStateObject):
     properties = ('x', 'y', 'z')
 
+    def __init__(self, state: dict, name: str = None):
+        super().__init__(state, name)
+        self.frame = None
+        self._frame_observers = []
 
-class Accelerometer(CachedStateObject):
-    properties = ('x', 'y', 'z')
+    def set_streaming(self, enabled=True):
+        self._to_update_state['stream'] = enabled
 
+    def frame_received(self, frame: numpy.ndarray):
+        # frame['t'] holds the timestamps and frame['xyz'] a (samples, 3) view of the values
+        self.frame = frame
+        for observer in self._frame_observers:
+            observer(self, frame)
 
-class Robot:
+    def register_frames(self, observer):
+        self._frame_observers.append(observer)
+
+    def unregister_frames(self, observer):
+        self._frame_observers.remove(observer)
+
+
+class Magnetometer(StreamingSensor):
+    pass
+
+
+class Accelerometer(StreamingSensor):
+    pass
+
+
+class BaseRobot:
+    """State, collections and message handling shared by the threaded and the asyncio clients.
+    Subclasses provide the connection through _publish and feed messages to _process_message."""
     WAIT_FOR_AREAS = {'servos', 'motors', 'leds', 'distance_sensors', 'line_sensors', 'magnetometers', 'accelerometers'}
     AREA_MAP = {'distancesensors': 'distance_sensors', 'linesensors': 'line_sensors'}
-
-    def __init__(self):
-        self.servos = NamedCachedStateObjectCollection(Servo)
-        self.motors = NamedCachedStateObjectCollection(Motor)
-        self.distance_sensors = NamedCachedStateObjectCollection(DistanceSensor)
-        self.line_sensors = NamedCachedStateObjectCollection(LineSensor)
-        self.leds = NamedCachedStateObjectCollection(Led)
-        self.magnetometers = NamedCachedStateObjectCollection(Magnetometer)
-        self.accelerometers = NamedCachedStateObjectCollection(Accelerometer)
+    TOPIC_AREAS = {area: topic for topic, area in AREA_MAP.items()}
+    STREAM_AREAS = {'magnetometers', 'accelerometers'}
+
+    command_class = Command
+
+    def __init__(self, codec=None, history: dict = None, command_timeout: float = 5.0, observers='all',
+                 transport=None, clock=None, metrics: str = None, areas=None, prefix: str = None):
+        # observers: 'all' or 'latest' to call observers on a worker thread with that policy, 'sync' to call
+        # them straight from the message handling, or an ObserverDispatcher shared with other robots.
+        # transport: None for MQTT, or a LocalTransport to talk to controllers in the same process. clock: a
+        # VirtualClock to run against a Simulation. metrics: a name to collect metrics under, published every
+        # metrics_interval on robot/<name>/metrics. areas: the areas to subscribe to, e.g. ['motors',
+        # 'distance_sensors'], None for all; the others are subscribed to on first use of their collection.
+        # prefix: the first level of the topics of the robot, see topic_prefix
+        if isinstance(observers, ObserverDispatcher):
+            self.dispatcher = observers
+        else:
+            self.dispatcher = None if observers == 'sync' else ObserverDispatcher(observers)
+        self.triggers = TriggerIndex()
+        self.clock = clock if clock is not None else REAL_TIME
+        self.servos = self._collection(Servo, 'servos')
+        self.motors = self._collection(Motor, 'motors')
+        self.distance_sensors = self._collection(DistanceSensor, 'distance_sensors')
+        self.line_sensors = self._collection(LineSensor, 'line_sensors')
+        self.leds = self._collection(Led, 'leds')
+        self.magnetometers = self._collection(Magnetometer, 'magnetometers')
+        self.accelerometers = self._collection(Accelerometer, 'accelerometers')
+        self._all_areas = areas is None
+        self.areas = set(BaseRobot.WAIT_FOR_AREAS if areas is None else
+                         (BaseRobot.AREA_MAP.get(area, area) for area in areas))
+        for area in BaseRobot.WAIT_FOR_AREAS - self.areas:
+            getattr(self, area).activate = self._activate
+        for area, size in (history or {}).items():
+            getattr(self, area).keep_history(size)
         self._led_brightness = None
-
-        client = mqtt.Client()
-        self.topic_prefix = 'robot'
-        client.on_connect = self._on_connect
-        client.on_message = self._on_message
-        self._client = client
+        self._led_effect = None
+        # The state of the controller rules by name, see RulesController
+        self.rules = {}
+        self._codec = codec if codec is not None else JSONCodec()
+        self.transport = transport
+        self.metrics_name = metrics
+        self.metrics = Metrics() if metrics else None
+        self.metrics_interval = DEFAULT_INTERVAL
+        self.topic_prefix = prefix if prefix is not None else topic_prefix()
         self._areas_received = set()
-        self.init_event = threading.Event()
-        self.servos_updated_event = threading.Event()
+        self.command_timeout = command_timeout
+        self._commands = {}
+        self._commands_lock = threading.Lock()
+        # Acks arrive on the state topics every client receives, so clients start their ids at random
+        self._last_command_id = random.randrange(0xffffffff)
+
+    def _collection(self, state_class, area):
+        return NamedCachedStateObjectCollection(state_class, dispatcher=self.dispatcher, triggers=self.triggers,
+                                                area=area, clock=self.clock)
+
+    def _activate(self, collection: NamedCachedStateObjectCollection):
+        self.areas.add(collection.area)
+        self._subscribe_area(collection.area)
+
+    def _subscribe_area(self, area: str):
+        # Connected clients subscribe to an area that is used for the first time
+        pass
+
+    def _use_area(self, area: str):
+        # Commands are acknowledged on the state topic of their area, which is subscribed to first
+        area = BaseRobot.AREA_MAP.get(area, area)
+        collection = getattr(self, area, None)
+        if isinstance(collection, NamedCachedStateObjectCollection):
+            collection._use()
+        elif area == 'rules' and not self._all_areas and area not in self.areas:
+            # The rules are a dict, subscribed to on the first set_rule or remove_rule
+            self.areas.add(area)
+            self._subscribe_area(area)
+
+    def _area_topics(self, area: str):
+        topic_area = BaseRobot.TOPIC_AREAS.get(area, area)
+        topics = [f'{self.topic_prefix}/{topic_area}/state']
+        if area in BaseRobot.STREAM_AREAS:
+            topics.append(f'{self.topic_prefix}/{topic_area}/stream')
+        return topics
 
-    def connect(self, url=None):
-        if url is None:
-            url = os.environ.get('SIMPLEROBOT_MQTT_HOST', "mqtt://localhost")
-        host, kwargs = get_mqtt_connection_details(url)
-        self._client.connect(host, **kwargs)
-        self._client.loop_start()
-        self.init_event.wait()
+    @property
+    def pending_areas(self):
+        # The areas connect still waits for
+        return BaseRobot.WAIT_FOR_AREAS & self.areas - self._areas_received
 
     @property
     def led_brightness(self):
         return self._led_brightness
 
-    def update_leds(self, brightness=None):
+    @property
+    def led_effect(self):
+        # The name of the effect the controller runs, 'none' when there is none
+        return self._led_effect
+
+    def when(self, predicate, callback, once=False) -> Trigger:
+        """Calls callback() as soon as predicate() becomes true, e.g.
+
+            robot.when(lambda: robot.distance_sensors['front'].distance < 0.2, robot.stop)
+
+        The predicate is evaluated again only when a state property it read changes. The callback
+        runs on the thread that handles the messages, so it should be quick."""
+        return self.triggers.add(predicate, callback, once)
+
+    @property
+    def subscriptions(self):
+        if self._all_areas:
+            return [f'{self.topic_prefix}/+/state', f'{self.topic_prefix}/+/stream']
+        return [topic for area in sorted(self.areas) for topic in self._area_topics(area)]
+
+    def _leds_message(self, brightness=None):
         message = self._create_message(self.leds)
         if brightness is not None:
             message['brightness'] = brightness
-        if message:
-            self._send_message("leds/ctrl", message)
-
-    def update_servos(self):
-        message = self._create_message(self.servos)
-        if message:
-            self.servos_updated_event.clear()
-            self._send_message("servos/ctrl", message)
-            self.servos_updated_event.wait()
+        return message
 
-    def wait_for_servos(self):
-        for servo in self.servos.values():
-            servo.wait_for_target_reached()
+    @staticmethod
+    def _led_effect_message(effect, spec):
+        # effect None stops the running effect, see LEDController for the effects
+        return {'effect': dict(spec, type=effect) if effect is not None else None}
 
-    def update_motors(self):
-        message = self._create_message(self.motors)
-        if message:
-            self._send_message("motors/ctrl", message)
+    @staticmethod
+    def _rule_message(name, when, do, repeat=None):
+        spec = dict(when=when, do=do)
+        if repeat is not None:
+            spec['repeat'] = repeat
+        return {name: spec}
+
+    def _servos_message(self, synchronise=False):
+        # With synchronise all the servos in this update arrive at their target at the same time
+        message = self._create_message(self.servos)
+        if message and synchronise:
+            message['sync'] = True
+        return message
 
     @staticmethod
     def _create_message(named_objects: NamedCachedStateObjectCollection):
-        message = {name: item.pop_update_state() for name, item in named_objects.items() if item.needs_update}
+        # names_to_obj, so building an empty update does not subscribe to an area, see _use_area
+        message = {name: item.pop_update_state() for name, item in named_objects.names_to_obj.items()
+                   if item.needs_update}
         return message
 
-    def _send_message(self, topic: str, message: dict):
-        data = json.dumps(message)
-        self._client.publish(f'{self.topic_prefix}/{topic}', data)
-
-    def _on_connect(self, client, *args):
-        client.subscribe(f'{self.topic_prefix}/+/state')
+    def _create_command(self, area: str, message: dict, timeout: float = None):
+        # Tags the message with a new correlation id, the pending commands are kept oldest first
+        with self._commands_lock:
+            for command_id, command in list(self._commands.items()):
+                if not command.expired:
+                    break
+                del self._commands[command_id]
+            self._last_command_id = self._last_command_id % 0xffffffff + 1
+            command = self.command_class(self._last_command_id, area,
+                                         self.command_timeout if timeout is None else timeout, self.clock)
+            self._commands[command.id] = command
+        message['_id'] = command.id
+        return command
+
+    def _acknowledge(self, command_id, area):
+        # area is the area of the state topic, an ack for another area is another client's command
+        with self._commands_lock:
+            command = self._commands.get(command_id)
+            if command is None or command.area != area:
+                return
+            del self._commands[command_id]
+        if command is not None:
+            command.acknowledged()
+            if self.metrics is not None:
+                self.metrics.time(f'command.{command.area}', command.latency)
 
-    def _on_message(self, client, userdata, msg):
-        message = json.loads(msg.payload.decode())
-        area = msg.topic.split('/')[-2]
-        area = Robot.AREA_MAP.get(area, area)
+    def _send_message(self, topic: str, message: dict):
+        area = topic.split('/')[0]
+        if self.metrics is not None:
+            self.metrics.count(f'sent.{area}')
+        if self.transport is not None:
+            return self.transport.send_control(area, message)
+        data = self._codec.encode(area, message)
+        return self._publish(f'{self.topic_prefix}/{topic}', data)
+
+    def _publish(self, topic: str, data: bytes):
+        raise NotImplementedError
+
+    def _init_complete(self):
+        pass
+
+    def _servos_updated(self):
+        pass
+
+    def _area_received(self, area):
+        pass
+
+    def _metrics_message(self):
+        with self._commands_lock:
+            self.metrics.gauge('pending_commands', len(self._commands))
+        return json.dumps(self.metrics.snapshot(reset=True)).encode()
+
+    def _process_message(self, topic: str, payload: bytes):
+        if self.metrics is not None:
+            started = time.perf_counter()
+            self._parse_message(topic, payload)
+            self.metrics.time(f'on_message.{topic.split("/")[-2]}', time.perf_counter() - started)
+        else:
+            self._parse_message(topic, payload)
+
+    def _parse_message(self, topic: str, payload: bytes):
+        topic = topic.split('/')
+        area = topic[-2]
+        if topic[-1] == 'stream':
+            self._on_stream(area, payload)
+            return
+        self._handle_message(area, self._codec.decode(area, payload))
+
+    def _handle_message(self, area: str, message: dict):
+        command_id = message.pop('_ack', None)
+        topic_area = area
+        area = BaseRobot.AREA_MAP.get(area, area)
         collection = getattr(self, area, None)
-        if isinstance(collection, NamedCachedStateObjectCollection):
+        known = area == 'rules' or isinstance(collection, NamedCachedStateObjectCollection)
+        if area == 'rules':
+            merge_state(self.rules, message)
+            for name in [name for name, rule in self.rules.items() if rule is None]:
+                del self.rules[name]
+        elif known:
             if area == 'leds':
-                self._led_brightness = message['brightness']
-                message = message['leds']
+                if 'brightness' in message:
+                    self._led_brightness = message['brightness']
+                if 'effect' in message:
+                    self._led_effect = message['effect']
+                message = message.get('leds', {})
 
             collection.update_from_message(message)
-            self._areas_received.add(area)
-            areas_left = Robot.WAIT_FOR_AREAS - self._areas_received
-            if not areas_left:
-                self.init_event.set()
+        if known:
+            if area not in self._areas_received:
+                self._areas_received.add(area)
+                self._area_received(area)
+            if not self.pending_areas:
+                self._init_complete()
             if area == 'servos':
-                self.servos_updated_event.set()
+                self._servos_updated()
+        if command_id is not None:
+            self._acknowledge(command_id, topic_area)
 
+    def _on_stream(self, area, payload):
+        name, count, offset = decode_frame_header(payload)
+        collection = getattr(self, BaseRobot.AREA_MAP.get(area, area), None)
+        if isinstance(collection, NamedCachedStateObjectCollection):
+            sensor = collection.get(name)
+            if isinstance(sensor, StreamingSensor):
+                sensor.frame_received(numpy.frombuffer(payload, FRAME_DTYPE, count, offset))
+
+    # With the asyncio client the update methods are coroutines, these then return them to be awaited
     def forward(self, speed=100):
         self.motors['left'].set_speed(speed)
         self.motors['right'].set_speed(speed)
-        self.update_motors()
+        return self.update_motors()
 
     def stop(self):
         self.motors['left'].set_speed(0)
         self.motors['right'].set_speed(0)
-        self.update_motors()
+        return self.update_motors()
 
     def backward(self, speed=100):
         self.motors['left'].set_speed(speed * -1)
         self.motors['right'].set_speed(speed * -1)
-        self.update_motors()
+        return self.update_motors()
 
     def rotate_left(self, speed=100):
         self.motors['left'].set_speed(speed * -1)
         self.motors['right'].set_speed(speed)
-        self.update_motors()
+        return self.update_motors()
 
     def rotate_right(self, speed=100):
         self.motors['left'].set_speed(speed)
         self.motors['right'].set_speed(speed * -1)
-        self.update_motors()
+        return self.update_motors()
+
+
+class Robot(BaseRobot):
+    def __init__(self, codec=None, history: dict = None, command_timeout: float = 5.0, observers='all',
+                 transport=None, clock=None, metrics: str = None, areas=None, prefix: str = None, client=None):
+        # client: a connected paho client shared with other robots, which hands this robot its messages,
+        # see Fleet
+        super().__init__(codec, history, command_timeout, observers, transport, clock, metrics, areas, prefix)
+        self._shared_client = client is not None
+        if client is None:
+            client = mqtt.Client()
+            client.on_connect = self._on_connect
+            client.on_message = self._on_message
+        self._client = client
+        self.init_event = threading.Event()
+        self.connect_timeout = None
+        self._area_events = {}
+        self._network_thread = None
+
+    def connect(self, url=None, timeout: float = 10.0):
+        # Returns once every area in self.areas reported its state, raises ConnectTimeout after timeout seconds
+        self.connect_timeout = timeout
+        if not self.pending_areas:
+            self.init_event.set()
+        if self.transport is not None:
+            self.transport.connect(self)
+            self._wait_for_init(timeout)
+            return
+        if url is None:
+            url = os.environ.get('SIMPLEROBOT_MQTT_HOST', "mqtt://localhost")
+        host, kwargs = get_mqtt_connection_details(url)
+        self._client.connect(host, **kwargs)
+        self._client.loop_start()
+        self._wait_for_init(timeout)
+        if self.metrics is not None:
+            threading.Thread(target=self._publish_metrics, name='metrics', daemon=True).start()
+
+    def _wait_for_init(self, timeout):
+        if not self.clock.wait(self.init_event, timeout):
+            raise ConnectTimeout(f'No state received for {", ".join(sorted(self.pending_areas))}')
+
+    def _subscribe_area(self, area: str):
+        if self.transport is not None or self._shared_client or not self._client.is_connected():
+            # In-process clients receive every area, subscriptions are made on connect or by the Fleet
+            return
+        event = self._area_events[area] = threading.Event()
+        self._client.subscribe([(topic, 0) for topic in self._area_topics(area)])
+        # Waiting on the network thread, e.g. in an observer, would block the state it waits for
+        if threading.get_ident() != self._network_thread and not self.clock.wait(event, self.connect_timeout):
+            raise ConnectTimeout(f'No state received for {area}')
+
+    def _area_received(self, area):
+        event = self._area_events.get(area)
+        if event is not None:
+            event.set()
+
+    def _publish_metrics(self):
+        while True:
+            time.sleep(self.metrics_interval)
+            self._publish(f'{self.topic_prefix}/{self.metrics_name}/metrics', self._metrics_message())
+
+    # The update methods return a Command to wait on, or None when there was nothing to send
+
+    def _send_command(self, area: str, message: dict):
+        if message:
+            self._use_area(area)
+            command = self._create_command(area, message)
+            self._send_message(f"{area}/ctrl", message)
+            return command
+
+    def update_leds(self, brightness=None):
+        return self._send_command("leds", self._leds_message(brightness))
+
+    def start_led_effect(self, effect, **spec):
+        """Runs an effect on the controller until it finishes or another one starts, e.g.
+
+            robot.start_led_effect('chase', color=[255, 0, 0], period=0.1, leds=['left_top_back', ...])
+        """
+        return self._send_command("leds", self._led_effect_message(effect, spec))
+
+    def stop_led_effect(self):
+        return self._send_command("leds", self._led_effect_message(None, {}))
+
+    def set_rule(self, name, when, do, repeat=None):
+        """Adds or replaces a rule that the controller evaluates on every sensor reading, e.g.
+
+            robot.set_rule('front_stop', 'distancesensors.front.distance < 0.15', {'motors': {'left': 0, 'right': 0}})
+        """
+        return self._send_command("rules", self._rule_message(name, when, do, repeat))
+
+    def remove_rule(self, name):
+        return self._send_command("rules", {name: None})
+
+    def update_servos(self, synchronise=False, wait=True):
+        command = self._send_command("servos", self._servos_message(synchronise))
+        if command is not None and wait:
+            command.wait()
+        return command
+
+    def wait_for_servos(self):
+        for servo in self.servos.values():
+            if servo.target_angle != servo.angle:
+                self.clock.wait(servo.event)
+
+    def update_motors(self):
+        return self._send_command("motors", self._create_message(self.motors))
+
+    def update_magnetometers(self):
+        return self._send_command("magnetometers", self._create_message(self.magnetometers))
+
+    def update_accelerometers(self):
+        return self._send_command("accelerometers", self._create_message(self.accelerometers))
+
+    def _publish(self, topic: str, data: bytes):
+        self._client.publish(topic, data)
+
+    def wait_until(self, predicate, timeout: float = None) -> bool:
+        event = threading.Event()
+        trigger = self.when(predicate, event.set, once=True)
+        if not self.clock.wait(event, timeout):
+            trigger.cancel()
+            return False
+        return True
+
+    def _init_complete(self):
+        self.init_event.set()
+
+    def _on_connect(self, client, *args):
+        self._network_thread = threading.get_ident()
+        subscriptions = self.subscriptions
+        if subscriptions:
+            client.subscribe([(topic, 0) for topic in subscriptions])
+
+    def _on_message(self, client, userdata, msg):
+        try:
+            self._process_message(msg.topic, msg.payload)
+        except Exception:
+            # An exception would stop the network thread of paho
+            traceback.print_exc()
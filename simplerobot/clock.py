@@ -0,0 +1,91 @@
+import asyncio
+import selectors
+import time
+
+
+class Clock:
+    """Wall-clock time. The blocking waits of the threaded client go through a clock, so a
+    simulation can swap it for a VirtualClock."""
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait(self, event, timeout=None) -> bool:
+        return event.wait(timeout)
+
+
+REAL_TIME = Clock()
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    # Never blocks: when nothing is ready the clock jumps to the next timer of the loop instead
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if not events and timeout:
+            self.clock.advance(timeout)
+        return events
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    # Checked by the samplers, which read inline instead of on a worker thread the loop would not wait for
+    virtual_time = True
+
+    def __init__(self, clock):
+        super().__init__(_VirtualSelector(clock))
+        self.clock = clock
+
+    def time(self):
+        return self.clock.now
+
+
+class VirtualClock(Clock):
+    """Simulated time, driven by an event loop of its own. Time only moves on when the loop has
+    nothing left to run, so a simulation runs as fast as the code allows and always the same way.
+
+    Everything runs on the thread that calls sleep, wait or run: asyncio code is run with
+    clock.run(coroutine), threaded code waits through clock.sleep and clock.wait.
+    """
+    EPOCH = 1600000000.0
+    # How often wait() looks at its event
+    RESOLUTION = 0.005
+
+    def __init__(self, start=0.0):
+        self.now = start
+        self.loop = VirtualTimeLoop(self)
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def time(self):
+        return VirtualClock.EPOCH + self.now
+
+    def monotonic(self):
+        return self.now
+
+    def run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def sleep(self, seconds):
+        self.run(asyncio.sleep(seconds))
+
+    def wait(self, event, timeout=None) -> bool:
+        deadline = None if timeout is None else self.now + timeout
+        while not event.is_set():
+            if deadline is not None and self.now >= deadline:
+                return False
+            self.sleep(VirtualClock.RESOLUTION if deadline is None else min(VirtualClock.RESOLUTION,
+                                                                             deadline - self.now))
+        return True
+
+    def close(self):
+        self.loop.close()
@@ -0,0 +1,217 @@
+import json
+import os
+import struct
+
+MAGIC = 0xb5
+_MAGIC_BYTE = bytes((MAGIC,))
+_NESTED = 0x01
+_MAX_CACHED_LAYOUTS = 1024
+
+SERVO_STATES = ('idle', 'move')
+LED_EFFECTS = ('none', 'chase', 'pulse', 'gradient', 'keyframes')
+XYZ = (('x', 'f'), ('y', 'f'), ('z', 'f'))
+# Command correlation ids, see Component.handle_control
+COMMAND_EXTRAS = [('_id', 'I'), ('_ack', 'I')]
+
+
+class CodecError(Exception):
+    pass
+
+
+class _Fallback(Exception):
+    pass
+
+
+class JSONCodec:
+    name = 'json'
+
+    def encode(self, area: str, message: dict) -> bytes:
+        return json.dumps(message).encode()
+
+    def decode(self, area: str, payload: bytes) -> dict:
+        if payload[:1] == _MAGIC_BYTE:
+            raise CodecError(f'Binary message for area "{area}", the codecs of the robot and the client do not match')
+        return json.loads(payload)
+
+
+class Schema:
+    """Fixed layout for the messages of one area.
+
+    A binary message is laid out as:
+
+      magic, flags, extras mask, one property mask per object, packed values
+
+    The masks say which extras and which properties of each object are present, so the
+    same schema covers full state, partial state and control messages.  Properties are
+    either a struct format character or a tuple of allowed values (sent as the index).
+    """
+
+    def __init__(self, names, properties, container=None, extras=()):
+        self.names = list(names)
+        self.properties = list(properties)
+        self.container = container
+        self.extras = list(extras)
+        if len(self.properties) > 8 or len(self.extras) > 8:
+            raise CodecError('A schema supports at most 8 properties and 8 extras')
+        self._name_index = {name: index for index, name in enumerate(self.names)}
+        self._header_size = 3 + len(self.names)
+        self._layouts = {}
+
+    @staticmethod
+    def _pack_fields(fields, values_dict, fmts, values):
+        mask = 0
+        matched = 0
+        for bit, (key, fmt) in enumerate(fields):
+            if key in values_dict:
+                value = values_dict[key]
+                if isinstance(fmt, tuple):
+                    if value not in fmt:
+                        raise _Fallback
+                    value = fmt.index(value)
+                    fmt = 'B'
+                mask |= 1 << bit
+                matched += 1
+                fmts.append(fmt)
+                values.append(value)
+        if matched != len(values_dict):
+            raise _Fallback
+        return mask
+
+    def encode(self, message: dict) -> bytes:
+        flags = 0
+        if self.container is not None and self.container in message:
+            flags |= _NESTED
+            objects = message[self.container]
+            top = {key: value for key, value in message.items() if key != self.container}
+        else:
+            objects = message
+            top = {key: value for key, value in message.items() if key not in self._name_index}
+
+        fmts = ['<']
+        values = []
+        extras_mask = self._pack_fields(self.extras, top, fmts, values)
+        masks = bytearray(len(self.names))
+        matched = 0
+        for index, name in enumerate(self.names):
+            state = objects.get(name)
+            if state is None:
+                continue
+            if not isinstance(state, dict):
+                raise _Fallback
+            masks[index] = self._pack_fields(self.properties, state, fmts, values)
+            matched += 1
+        if flags & _NESTED and matched != len(objects):
+            raise _Fallback
+
+        try:
+            body = struct.pack(''.join(fmts), *values)
+        except struct.error:
+            raise _Fallback
+        return bytes((MAGIC, flags, extras_mask)) + masks + body
+
+    def _compile(self, masks: bytes):
+        fmts = ['<']
+        layout = []
+
+        def add(name, fields, mask):
+            for bit, (key, fmt) in enumerate(fields):
+                if mask & (1 << bit):
+                    enum = fmt if isinstance(fmt, tuple) else None
+                    fmts.append('B' if enum else fmt)
+                    layout.append((name, key, enum))
+
+        add(None, self.extras, masks[1])
+        for index, name in enumerate(self.names):
+            add(name, self.properties, masks[2 + index])
+        if len(self._layouts) >= _MAX_CACHED_LAYOUTS:
+            self._layouts.clear()
+        compiled = self._layouts[masks] = (struct.Struct(''.join(fmts)), layout)
+        return compiled
+
+    def decode(self, payload: bytes) -> dict:
+        masks = bytes(payload[1:self._header_size])
+        compiled = self._layouts.get(masks)
+        if compiled is None:
+            compiled = self._compile(masks)
+        unpacker, layout = compiled
+
+        result = {}
+        objects = result
+        if masks[0] & _NESTED:
+            objects = result[self.container] = {}
+        for (name, key, enum), value in zip(layout, unpacker.unpack_from(payload, self._header_size)):
+            if enum is not None:
+                value = enum[value]
+            if name is None:
+                result[key] = value
+            else:
+                state = objects.get(name)
+                if state is None:
+                    state = objects[name] = {}
+                state[key] = value
+        return result
+
+
+class StructCodec:
+    name = 'binary'
+
+    def __init__(self, schemas: dict):
+        self.schemas = schemas
+        self._json = JSONCodec()
+
+    def encode(self, area: str, message: dict) -> bytes:
+        schema = self.schemas.get(area)
+        if schema is not None:
+            try:
+                return schema.encode(message)
+            except _Fallback:
+                pass
+        # Anything the schema cannot describe is still sent, as JSON
+        return self._json.encode(area, message)
+
+    def decode(self, area: str, payload: bytes) -> dict:
+        if payload[:1] == _MAGIC_BYTE:
+            schema = self.schemas.get(area)
+            if schema is None:
+                raise CodecError(f'No binary schema for area "{area}"')
+            return schema.decode(payload)
+        return self._json.decode(area, payload)
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(schemas_from_config(config))
+
+
+def schemas_from_config(config: dict) -> dict:
+    schemas = {}
+    if 'servos' in config:
+        schemas['servos'] = Schema([servo['name'] for servo in config['servos'].values()],
+                                   [('state', SERVO_STATES), ('angle', 'f'), ('target_angle', 'f'), ('speed', 'f'),
+                                    ('angle_min', 'f'), ('angle_max', 'f')], extras=[('sync', '?')] + COMMAND_EXTRAS)
+    if 'motors' in config:
+        schemas['motors'] = Schema([motor['name'] for motor in config['motors']], [('speed', 'f')],
+                                   extras=COMMAND_EXTRAS)
+    if 'distancesensors' in config:
+        schemas['distancesensors'] = Schema(config['distancesensors'], [('distance', 'f')], extras=COMMAND_EXTRAS)
+    if 'linesensors' in config:
+        schemas['linesensors'] = Schema(config['linesensors'], [('line', 'f')], extras=COMMAND_EXTRAS)
+    if 'leds' in config:
+        schemas['leds'] = Schema(config['leds']['names'].values(), [('red', 'B'), ('green', 'B'), ('blue', 'B')],
+                                 container='leds', extras=[('brightness', 'B'), ('effect', LED_EFFECTS)] + COMMAND_EXTRAS)
+    if 'magnetometers' in config:
+        schemas['magnetometers'] = Schema(config['magnetometers'], XYZ, extras=COMMAND_EXTRAS)
+    if 'accelerometers' in config:
+        schemas['accelerometers'] = Schema(config['accelerometers'], XYZ, extras=COMMAND_EXTRAS)
+    return schemas
+
+
+def get_codec(config: dict = None, name: str = None):
+    if name is None:
+        name = os.environ.get('SIMPLEROBOT_CODEC', (config or {}).get('codec', 'json'))
+    if name == 'json':
+        return JSONCodec()
+    if name == 'binary':
+        if config is None:
+            raise CodecError('The binary codec needs the robot configuration')
+        return StructCodec.from_config(config)
+    raise CodecError(f'Unknown codec "{name}"')
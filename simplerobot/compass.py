@@ -1,56 +1,221 @@
-from .utils import MovingAverage
+from .utils import FilterBank
+import json
 import math
+import os
+import numpy
 # inspiration and code taken from https://github.com/adafruit/Adafruit_CircuitPython_LIS2MDL/blob/main/examples/
 
+DEFAULT_CALIBRATION_FILE = os.path.join('~', '.simplerobot', 'compass.json')
+
+# The ellipsoid is only fitted when the samples spread at least this much along every direction,
+# relative to the widest one
+MIN_SPREAD = 0.25
+# An automatic refit is only saved when it moves the corrected field by more than this, relative to
+# its strength, so a settled calibration is not written again on every refit
+SAVE_TOLERANCE = 0.02
+# Columns of the quadric a.x² + b.y² + c.z² + 2d.xy + 2e.xz + 2f.yz + 2g.x + 2h.y + 2i.z = 1
+_XY_COLUMNS = [0, 1, 3, 6, 7]
+
+
+class EllipsoidCalibration:
+    """Hard and soft iron calibration from a least-squares ellipsoid fit.
+
+    Samples are accumulated into the normal equations of the fit, so adding a sample is O(1)
+    and the fit can be refreshed at any time. When the samples do not cover enough of the
+    sphere (e.g. the robot only turned on the spot) the fit falls back to an ellipse in the
+    horizontal plane.
+    """
 
-class MinMax:
     def __init__(self):
-        self.min = 1000
-        self.max = -1000
+        self.offset = numpy.zeros(3)
+        self.matrix = numpy.eye(3)
+        self.fitted = False
+        self.count = 0
+        self._normal = numpy.zeros((9, 9))
+        self._rhs = numpy.zeros(9)
+        self._sum = numpy.zeros(3)
+
+    def add(self, sample):
+        x, y, z = sample
+        row = numpy.array((x * x, y * y, z * z, 2 * x * y, 2 * x * z, 2 * y * z, 2 * x, 2 * y, 2 * z))
+        self._normal += numpy.outer(row, row)
+        self._rhs += row
+        self._sum += sample
+        self.count += 1
+
+    def fit(self) -> bool:
+        if self.count < 9:
+            return False
+        fit = self._fit_ellipsoid() or self._fit_ellipse()
+        if fit is None:
+            return False
+        self.offset, self.matrix = fit
+        self.fitted = True
+        return True
+
+    @staticmethod
+    def _correction(quadric, linear):
+        # (v - c)ᵀ A (v - c) = 1 + cᵀ A c with c = -A⁻¹ g, the correction maps the ellipsoid on a unit sphere
+        center = -numpy.linalg.solve(quadric, linear)
+        shape = quadric / (1 + center @ quadric @ center)
+        eigenvalues, eigenvectors = numpy.linalg.eigh(shape)
+        if numpy.any(eigenvalues <= 0):
+            return None
+        return center, eigenvectors @ numpy.diag(numpy.sqrt(eigenvalues)) @ eigenvectors.T
+
+    def _spread(self):
+        # Standard deviations along the principal axes of the samples, smallest first
+        mean = self._sum / self.count
+        r = self._rhs / self.count
+        second = numpy.array(((r[0], r[3] / 2, r[4] / 2), (r[3] / 2, r[1], r[5] / 2), (r[4] / 2, r[5] / 2, r[2])))
+        return numpy.sqrt(numpy.maximum(numpy.linalg.eigvalsh(second - numpy.outer(mean, mean)), 0))
+
+    def _fit_ellipsoid(self):
+        spread = self._spread()
+        if spread[0] < MIN_SPREAD * spread[-1] or numpy.linalg.cond(self._normal) > 1e12:
+            return None
+        a, b, c, d, e, f, g, h, i = numpy.linalg.solve(self._normal, self._rhs)
+        return self._correction(numpy.array(((a, d, e), (d, b, f), (e, f, c))), numpy.array((g, h, i)))
+
+    def _fit_ellipse(self):
+        normal = self._normal[numpy.ix_(_XY_COLUMNS, _XY_COLUMNS)]
+        if numpy.linalg.cond(normal) > 1e12:
+            return None
+        a, b, d, g, h = numpy.linalg.solve(normal, self._rhs[_XY_COLUMNS])
+        fit = self._correction(numpy.array(((a, d), (d, b))), numpy.array((g, h)))
+        if fit is None:
+            return None
+        center, matrix = fit
+        # z is not covered by the samples: centre it on its mean and give it the average horizontal scale
+        offset = numpy.array((center[0], center[1], self._sum[2] / self.count))
+        correction = numpy.diag([0.0, 0.0, numpy.sqrt(numpy.linalg.det(matrix))])
+        correction[:2, :2] = matrix
+        return offset, correction
+
+    def correct(self, sample):
+        return self.matrix @ (numpy.asarray(sample, dtype=float) - self.offset)
+
+    def to_dict(self):
+        return dict(offset=self.offset.tolist(), matrix=self.matrix.tolist(), count=self.count,
+                    normal=self._normal.tolist(), rhs=self._rhs.tolist(), sum=self._sum.tolist())
+
+    @classmethod
+    def from_dict(cls, details: dict):
+        calibration = cls()
+        calibration.offset = numpy.array(details['offset'])
+        calibration.matrix = numpy.array(details['matrix'])
+        calibration.count = details.get('count', 0)
+        if 'normal' in details:
+            calibration._normal = numpy.array(details['normal'])
+            calibration._rhs = numpy.array(details['rhs'])
+            calibration._sum = numpy.array(details['sum'])
+        calibration.fitted = True
+        return calibration
 
-    def update(self, value):
-        self.min = min(self.min, value)
-        self.max = max(self.max, value)
 
-    def normalise(self, value):
-        axis = min(max(value, self.min), self.max)
-        return (axis - self.min) * 200 / (self.max - self.min) + -100
+class CalibrationStore:
+    def __init__(self, filename=None):
+        if filename is None:
+            filename = os.environ.get('SIMPLEROBOT_CALIBRATION', DEFAULT_CALIBRATION_FILE)
+        self.filename = os.path.expanduser(filename)
 
-    def __str__(self):
-        return f'{self.min} - {self.max}'
+    def _read(self):
+        try:
+            with open(self.filename) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def load(self, name):
+        details = self._read().get(name)
+        return None if details is None else EllipsoidCalibration.from_dict(details)
+
+    def save(self, name, calibration: EllipsoidCalibration):
+        calibrations = self._read()
+        calibrations[name] = calibration.to_dict()
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        with open(self.filename, 'w') as f:
+            json.dump(calibrations, f)
 
 
 class Compass:
-    def __init__(self, magnetometer):
+    REFIT_INTERVAL = 50
+
+    def __init__(self, magnetometer, accelerometer=None, store=None, auto_calibrate=False):
         self.calibrating = False
-        self.calibration = None
+        self.auto_calibrate = auto_calibrate
+        self.store = store if store is not None else CalibrationStore()
+        self.calibration = self.store.load(magnetometer.name) or EllipsoidCalibration()
+        # The offset and matrix last saved or loaded
+        self._saved = (self.calibration.offset, self.calibration.matrix) if self.calibration.fitted else None
         self.magnetometer = magnetometer
+        self.accelerometer = accelerometer
+        self.filter = FilterBank(3, 10)
+        self.gravity = FilterBank(3, 10) if accelerometer is not None else None
+        self._bearing = None
         self.magnetometer.register(self._sensor_updated)
-        self.average = {axis: MovingAverage(10) for axis in 'xyz'}
+        if accelerometer is not None:
+            accelerometer.register(self._accelerometer_updated)
+
+    @property
+    def is_calibrated(self):
+        return self.calibration.fitted
 
     def calibration_start(self):
-        self.calibration = {'x': MinMax(), 'y': MinMax(), 'z': MinMax()}
+        self.calibration = EllipsoidCalibration()
         self.calibrating = True
 
     def calibration_finish(self):
         self.calibrating = False
-        for axis in 'xyz':
-            print(f'{axis} : {self.calibration[axis]}')
+        if self.calibration.fit():
+            self._save()
+        print(f'offset : {self.calibration.offset}')
+        print(f'matrix : {self.calibration.matrix.tolist()}')
+
+    def _save(self):
+        self.store.save(self.magnetometer.name, self.calibration)
+        self._saved = (self.calibration.offset, self.calibration.matrix)
+
+    def _changed(self):
+        if self._saved is None:
+            return True
+        offset, matrix = self._saved
+        calibration = self.calibration
+        # How far the samples move after correction, the corrected field has a strength of 1
+        shift = numpy.abs(calibration.matrix @ (calibration.offset - offset)).max()
+        scale = numpy.abs(calibration.matrix - matrix).max() / numpy.abs(matrix).max()
+        return max(shift, scale) > SAVE_TOLERANCE
+
+    def _accelerometer_updated(self, sensor):
+        self.gravity.add((sensor.x, sensor.y, sensor.z))
 
     def _sensor_updated(self, sensor):
-        if self.calibrating:
-            for axis in 'xyz':
-                self.calibration[axis].update(getattr(sensor, axis))
+        sample = (sensor.x, sensor.y, sensor.z)
+        if self.calibrating or self.auto_calibrate:
+            self.calibration.add(sample)
+            if self.auto_calibrate and self.calibration.count % Compass.REFIT_INTERVAL == 0:
+                if self.calibration.fit() and self._changed():
+                    self._save()
 
-        for axis in 'xyz':
-            self.average[axis].add(getattr(sensor, axis))
+        self.filter.add(sample)
+        self._bearing = self._compute_bearing()
 
-    @property
-    def bearing(self):
-        # we will only use X and Y for the compass calculations, so hold it level!
-        bearing = int(math.atan2(self.calibration['x'].normalise(self.average['x'].average),
-                                 self.calibration['y'].normalise(self.average['y'].average)) * 180.0 / math.pi)
+    def _compute_bearing(self):
+        x, y, z = self.calibration.correct(self.filter.value)
+        if self.gravity is not None and self.gravity.is_valid:
+            # Project the field on the horizontal plane using roll and pitch from gravity
+            gx, gy, gz = self.gravity.value
+            roll = math.atan2(gy, gz)
+            pitch = math.atan2(-gx, math.hypot(gy, gz))
+            x, y = (x * math.cos(pitch) + z * math.sin(pitch),
+                    x * math.sin(roll) * math.sin(pitch) + y * math.cos(roll) - z * math.sin(roll) * math.cos(pitch))
+        bearing = int(math.atan2(x, y) * 180.0 / math.pi)
         # compass_heading is between -180 and +180 since atan2 returns -pi to +pi
         # this translates it to be between 0 and 360
         bearing += 180
         return bearing
+
+    @property
+    def bearing(self):
+        # Computed once per magnetometer update
+        return self._bearing
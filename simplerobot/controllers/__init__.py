@@ -1,7 +1,39 @@
-from .servo import ServoController
-from .motor import MotorController
-from .distancesensor import DistanceSensorController
-from .led import LEDController
-from .linesensor import LineSensorController
-from .magnetometer import MagnetometerController
-from .accelerometer import AccelerometerController
\ No newline at end of file
+import functools
+import importlib
+
+# Controller class: module. The modules are imported on first use, so importing one controller, e.g. in
+# StartupPipeline, does not import the others
+_MODULES = {
+    'ServoController': 'servo',
+    'MotorController': 'motor',
+    'DistanceSensorController': 'distancesensor',
+    'LEDController': 'led',
+    'LineSensorController': 'linesensor',
+    'MagnetometerController': 'magnetometer',
+    'AccelerometerController': 'accelerometer',
+    'RulesController': 'rules',
+}
+__all__ = list(_MODULES)
+
+
+def __getattr__(name):
+    module = _MODULES.get(name)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    return getattr(importlib.import_module(f'.{module}', __name__), name)
+
+
+def drivers(load):
+    """Decorates the function of a controller module that imports its drivers, or defines emulators
+    for them, and returns them by name. The first call, when the first controller is built, makes
+    them globals of the module, so only the drivers the configuration uses are loaded."""
+    loaded = False
+
+    @functools.wraps(load)
+    def load_once():
+        nonlocal loaded
+        if not loaded:
+            load.__globals__.update(load())
+            loaded = True
+
+    return load_once
@@ -1,42 +1,78 @@
-import asyncio
+import functools
+from simplerobot.controllers import drivers
 from simplerobot.mqtt import Component
+from simplerobot.sampling import sampler, sample_rate, stream_settings, StreamSampler
 
-try:
-    import board
-    from adafruit_lsm303_accel import LSM303_Accel
+LSM303_Accel = i2c = None
 
-    i2c = board.I2C()  # uses board.SCL and board.SDA
-except:
-    i2c = None
 
-    class LSM303_Accel:
-        def __init__(self, i2c):
-            self.acceleration = (0, 0, 9.8)
+@drivers
+def load_drivers():
+    try:
+        import board
+        from adafruit_lsm303_accel import LSM303_Accel
+
+        i2c = board.I2C()  # uses board.SCL and board.SDA
+    except:
+        i2c = None
+
+        class LSM303_Accel:
+            def __init__(self, i2c):
+                self.acceleration = (0, 0, 9.8)
+
+    return dict(LSM303_Accel=LSM303_Accel, i2c=i2c)
 
 
 class AccelerometerController(Component):
     def __init__(self, config: dict):
-        super().__init__("accelerometers")
+        super().__init__("accelerometers", config)
+        load_drivers()
         self.accelerometers = {}
+        self.rates = {}
+        self.stream_settings = {}
+        self.streams = {}
         self.state = {}
         for name, details in config['accelerometers'].items():
             if details['type'] == 'lsm303':
                 sensor = LSM303_Accel(i2c)
                 self.accelerometers[name] = sensor
+                self.rates[name] = sample_rate(details)
+                self.stream_settings[name] = stream_settings(details)
                 self.state[name] = {axis: value for axis, value in zip('xyz', sensor.acceleration)}
 
-    async def start(self):
-        asyncio.create_task(self.measure())
-        await super().start()
-
-    async def measure(self):
-        while True:
-            await asyncio.sleep(0.06)
-            update = False
-            for name, sensor in self.accelerometers.items():
-                new_measurement = {axis: value for axis, value in zip('xyz', sensor.acceleration)}
-                if new_measurement != self.state[name]:
-                    self.state[name] = new_measurement
-                    update = True
-            if update:
-                self.update_state()
+    def start_tasks(self):
+        for name, sensor in self.accelerometers.items():
+            read = functools.partial(getattr, sensor, 'acceleration')
+            self.scheduler.every(f'{self.name}.{name}', 1.0 / self.rates[name],
+                                 sampler(read, functools.partial(self.measured, name), bus='i2c'))
+            if self.stream_settings[name]['enabled']:
+                self.start_stream(name)
+        super().start_tasks()
+
+    def process_control(self, message):
+        for name, details in message.items():
+            if name in self.accelerometers and isinstance(details, dict) and 'stream' in details:
+                if details['stream']:
+                    self.start_stream(name)
+                else:
+                    self.stop_stream(name)
+
+    def start_stream(self, name):
+        if name not in self.streams:
+            settings = self.stream_settings[name]
+            read = functools.partial(getattr, self.accelerometers[name], 'acceleration')
+            stream = StreamSampler(name, read, settings['rate'], settings['frame'], self.publish_stream, self.loop,
+                                   bus='i2c')
+            self.streams[name] = stream
+            stream.start()
+
+    def stop_stream(self, name):
+        stream = self.streams.pop(name, None)
+        if stream is not None:
+            stream.stop()
+
+    def measured(self, name, acceleration):
+        new_measurement = {axis: value for axis, value in zip('xyz', acceleration)}
+        if new_measurement != self.state[name]:
+            self.state[name] = new_measurement
+            self.update_state()
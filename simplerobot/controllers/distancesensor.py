@@ -1,41 +1,50 @@
+from simplerobot.controllers import drivers
 from simplerobot.mqtt import Component
-import asyncio
+from simplerobot.sampling import sampler, sample_rate
+import functools
 
-try:
-    from gpiozero.pins.pigpio import PiGPIOFactory
-    from gpiozero import DistanceSensor
+DistanceSensor = PiGPIOFactory = None
 
-except:
-    class DistanceSensor:
-        def __init__(self, echo, trigger, max_distance=1, pin_factory=None):
-            self.distance = 0
 
-    class PiGPIOFactory:
-        pass
+@drivers
+def load_drivers():
+    try:
+        from gpiozero.pins.pigpio import PiGPIOFactory
+        from gpiozero import DistanceSensor
+
+    except:
+        class DistanceSensor:
+            def __init__(self, echo, trigger, max_distance=1, pin_factory=None):
+                self.distance = 0
+
+        class PiGPIOFactory:
+            pass
+
+    return dict(DistanceSensor=DistanceSensor, PiGPIOFactory=PiGPIOFactory)
 
 
 class DistanceSensorController(Component):
     def __init__(self, config: dict):
-        super().__init__("distancesensors")
+        super().__init__("distancesensors", config)
+        load_drivers()
         self.sensors = {}
+        self.rates = {}
         self.state = {}
         for name, sensor in config['distancesensors'].items():
             self.sensors[name] = DistanceSensor(sensor['echo'], sensor['trigger'], max_distance=sensor['max_distance'],
                                                 pin_factory=PiGPIOFactory())
+            self.rates[name] = sample_rate(sensor)
             self.state[name] = {"distance": -1}
 
-    async def start(self):
-        asyncio.create_task(self.measure())
-        await super().start()
-
-    async def measure(self):
-        while True:
-            await asyncio.sleep(0.06)
-            update = False
-            for name, sensor in self.sensors.items():
-                new_measurement = sensor.distance
-                if new_measurement != self.state[name]['distance']:
-                    self.state[name]['distance'] = new_measurement
-                    update = True
-            if update:
-                self.update_state()
+    def start_tasks(self):
+        for name, sensor in self.sensors.items():
+            read = functools.partial(getattr, sensor, 'distance')
+            self.scheduler.every(f'{self.name}.{name}', 1.0 / self.rates[name],
+                                 sampler(read, functools.partial(self.measured, name), bus='gpio'))
+        super().start_tasks()
+
+    def measured(self, name, distance):
+        if distance != self.state[name]['distance']:
+            self.state[name]['distance'] = distance
+            self.update_state()
+        self.notify_reading(name, self.state[name])
@@ -1,44 +1,54 @@
+from simplerobot.effects import create_effect
+from simplerobot.controllers import drivers
 from simplerobot.mqtt import Component
+import numpy
 
-try:
-    from rpi_ws281x import PixelStrip, Color
-except:
-    class PixelStrip:
-        def __init__(self, count, pin, frequency, dma, invert, brightness, channel):
-            self.count = count
-            self.pin = pin
-            self.frequency = frequency
-            self.dma = dma
-            self.invert = invert
-            self.brightness = brightness
-            self.channel = channel
-            self.pixels = [Color(0, 0, 0)] * count
+PixelStrip = Color = None
 
-        def getBrightness(self):
-            return self.brightness
 
-        def setBrightness(self, brightness):
-            self.brightness = brightness
+@drivers
+def load_drivers():
+    try:
+        from rpi_ws281x import PixelStrip, Color
+    except:
+        class PixelStrip:
+            def __init__(self, count, pin, frequency, dma, invert, brightness, channel):
+                self.count = count
+                self.pin = pin
+                self.frequency = frequency
+                self.dma = dma
+                self.invert = invert
+                self.brightness = brightness
+                self.channel = channel
+                self.pixels = [Color(0, 0, 0)] * count
 
-        def setPixelColor(self, index, color):
-            self.pixels[index] = color
+            def getBrightness(self):
+                return self.brightness
 
-        def begin(self):
-            pass
+            def setBrightness(self, brightness):
+                self.brightness = brightness
 
-        def show(self):
-            print("Updating pixels")
-            for i, color in enumerate(self.pixels):
-                print(f"  {i}: {color}")
+            def setPixelColor(self, index, color):
+                self.pixels[index] = color
 
-    class Color:
-        def __init__(self, r, g, b):
-            self.r = r
-            self.g = g
-            self.b = b
+            def begin(self):
+                pass
 
-        def __str__(self):
-            return f"red {self.r} green {self.g} blue {self.b}"
+            def show(self):
+                print("Updating pixels")
+                for i, color in enumerate(self.pixels):
+                    print(f"  {i}: {color}")
+
+        class Color:
+            def __init__(self, r, g, b):
+                self.r = r
+                self.g = g
+                self.b = b
+
+            def __str__(self):
+                return f"red {self.r} green {self.g} blue {self.b}"
+
+    return dict(PixelStrip=PixelStrip, Color=Color)
 
 
 class PixelStripLED:
@@ -61,27 +71,66 @@ class PixelStripLED:
 
 
 class LEDController(Component):
+    """Sets the LEDs to the colours of a control message, or runs an effect, e.g.
+
+        {"effect": {"type": "pulse", "color": [0, 0, 255], "period": 2, "leds": ["left_top_front"]}}
+
+    Effects (see simplerobot.effects) are rendered on the controller at up to frame_rate frames per
+    second; the strip is only updated when a frame differs from the one shown, and the state is
+    published at most every state_interval seconds while an effect runs. {"effect": null} or
+    setting a colour stops the effect.
+    """
+    FRAME_RATE = 30
+    STATE_INTERVAL = 1.0
+
     def __init__(self, config: dict):
-        super().__init__("leds")
+        super().__init__("leds", config)
         self.controller = None
         self.leds = {}
         led_config = config['leds']
+        effects_config = led_config.get('effects') or {}
+        self.frame_rate = effects_config.get('frame_rate', LEDController.FRAME_RATE)
+        self.state_interval = effects_config.get('state_interval', LEDController.STATE_INTERVAL)
+        self.effect = None
+        self.task = None
+        self._state_time = 0.0
         if led_config['type'] == "pixelstrip":
             self._process_pixelstrip(led_config)
+        self._indexes = {name: led.index for name, led in self.leds.items()}
+        self._by_index = {led.index: led for led in self.leds.values()}
+        # What the effect renders and what the strip shows
+        self._frame = numpy.zeros((led_config['count'], 3))
+        self._shown = numpy.zeros((led_config['count'], 3), dtype=numpy.uint8)
 
     def _process_pixelstrip(self, config):
+        load_drivers()
         self.controller = PixelStrip(config['count'], config['pin'], config['frequency'], config['dma'],
                                      config['invert'], config['brightness'], config['channel'])
         self.controller.begin()
         for index, name in config['names'].items():
             self.leds[name] = PixelStripLED(self.controller, index)
 
+    def start_tasks(self):
+        self.task = self.scheduler.every(f'{self.name}.effects', 1.0 / self.frame_rate, self.render)
+        self.task.park()
+        super().start_tasks()
+
     def process_control(self, message):
         updated = False
+        if "effect" in message:
+            spec = message["effect"]
+            self.effect = create_effect(spec, self._indexes, self._frame, self.loop.time()) if spec else None
+            if self.effect is not None and self.task is not None:
+                self.task.wake()
+            updated = True
+
         for name, led in self.leds.items():
             if name in message:
                 state = message[name]
-                led.set_color(state.get('red', 0), state.get('green', 0), state.get('blue', 0))
+                color = (state.get('red', 0), state.get('green', 0), state.get('blue', 0))
+                led.set_color(*color)
+                self._frame[led.index] = self._shown[led.index] = color
+                self.effect = None
                 updated = True
 
         if "brightness" in message:
@@ -92,8 +141,35 @@ class LEDController(Component):
             self.controller.show()
             self.update_state()
 
+    def render(self):
+        if self.effect is None:
+            self.task.park()
+            return
+        now = self.loop.time()
+        finished = self.effect.render(now, self._frame)
+        frame = numpy.clip(numpy.rint(self._frame), 0, 255).astype(numpy.uint8)
+        changed = numpy.flatnonzero((frame != self._shown).any(axis=1))
+        if len(changed):
+            self._shown[changed] = frame[changed]
+            for index, (red, green, blue) in zip(changed.tolist(), frame[changed].tolist()):
+                led = self._by_index.get(index)
+                if led is not None:
+                    led.set_color(red, green, blue)
+                else:
+                    self.controller.setPixelColor(index, Color(red, green, blue))
+            self.controller.show()
+        if finished:
+            self.effect = None
+            self.task.park()
+        if finished or (len(changed) and now - self._state_time >= self.state_interval):
+            self.update_state()
+
+    def update_state(self, thread_safe=False, keyframe=False):
+        self._state_time = self.loop.time()
+        super().update_state(thread_safe, keyframe)
+
     @property
     def state(self):
         return { "brightness": self.controller.getBrightness(),
+                 "effect": self.effect.name if self.effect is not None else 'none',
                  "leds": {name: led.state for name, led in self.leds.items()}}
-
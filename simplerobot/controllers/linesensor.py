@@ -1,27 +1,40 @@
+from simplerobot.controllers import drivers
 from simplerobot.mqtt import Component
 import asyncio
+import functools
 
-try:
-    from gpiozero.pins.pigpio import PiGPIOFactory
-    from gpiozero import LineSensor
+LineSensor = None
 
-except:
-    class LineSensor:
-        def __init__(self, pin):
-            self.value = 0
+
+@drivers
+def load_drivers():
+    try:
+        from gpiozero.pins.pigpio import PiGPIOFactory
+        from gpiozero import LineSensor
+
+    except:
+        class LineSensor:
+            def __init__(self, pin):
+                self.value = 0
+
+    return dict(LineSensor=LineSensor)
 
 
 class LineSensorController(Component):
     def __init__(self, config: dict):
-        super().__init__("linesensors")
+        super().__init__("linesensors", config)
+        load_drivers()
         self.sensors = {}
         for name, sensor_config in config['linesensors'].items():
             sensor = LineSensor(sensor_config['pin'])
-            sensor.when_line = sensor.when_no_line = self._when_line_changed
+            sensor.when_line = sensor.when_no_line = functools.partial(self._when_line_changed, name)
             self.sensors[name] = sensor
 
-    def _when_line_changed(self):
+    def _when_line_changed(self, name):
+        # Called on a gpiozero thread
         self.update_state(True)
+        if self.host is not None and self.host.listeners:
+            self.loop.call_soon_threadsafe(self.notify_reading, name, {"line": self.sensors[name].value})
 
     @property
     def state(self):
@@ -1,20 +1,29 @@
+from simplerobot.controllers import drivers
 from simplerobot.mqtt import Component
 import asyncio
 
-try:
-    from gpiozero import Motor
-except:
-    class Motor:
-        def __init__(self, a, b, enable, _):
-            self.a = a
-            self.b = b
-            self.enable = enable
-            self.value = 0
+Motor = None
+
+
+@drivers
+def load_drivers():
+    try:
+        from gpiozero import Motor
+    except:
+        class Motor:
+            def __init__(self, a, b, enable, _):
+                self.a = a
+                self.b = b
+                self.enable = enable
+                self.value = 0
+
+    return dict(Motor=Motor)
 
 
 class MotorController(Component):
     def __init__(self, config: dict):
-        super().__init__("motors")
+        super().__init__("motors", config)
+        load_drivers()
         self.motors = {}
         for motor in config['motors']:
             self.motors[motor['name']] = Motor(motor['pin1'], motor['pin2'], motor['enable'], True)
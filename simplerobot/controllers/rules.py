@@ -0,0 +1,118 @@
+from simplerobot.mqtt import Component
+from simplerobot.rules import Rule
+from simplerobot.utils import copy_state
+import time
+
+
+class Readings(dict):
+    # A reading that was not sampled since the rules started is taken from the state of its controller
+    def __init__(self, components: dict):
+        super().__init__()
+        self.components = components
+
+    def __missing__(self, key):
+        area, name, prop = key.split('.')
+        component = self.components.get(area)
+        if component is None:
+            raise KeyError(key)
+        value = self[key] = component.state[name][prop]
+        return value
+
+
+class RulesController(Component):
+    """Reflexes that run next to the controllers: rules on the readings of the distance and line
+    sensors that send control messages straight to the motor and servo controllers, without a
+    round trip through the broker and a client. See Rule for the rules. While a rule holds, its
+    control messages are sent again after every other control message to their areas, so e.g. a
+    forward() does not drive on while the front_stop rule holds. Nor does a backward(); remove
+    the rule to back away.
+
+    The rules come from the 'rules' section of the configuration. A control message on
+    robot/rules/ctrl adds or replaces rules, {"name": {"when": ..., "do": ...}}, or removes them,
+    {"name": null}. Every firing is printed and published in the state of the rule.
+    """
+
+    def __init__(self, config: dict):
+        super().__init__("rules", config)
+        self.rules = {}
+        # Rules by the readings they depend on
+        self._dependants = {}
+        self._removed = set()
+        self.readings = None
+        # Set while the rules send control messages, which must not trigger the rules again
+        self._applying = False
+        for name, spec in (config.get('rules') or {}).items():
+            self.rules[name] = Rule(name, spec)
+        self._index()
+
+    def _index(self):
+        self._dependants = {}
+        for rule in self.rules.values():
+            for key in rule.keys:
+                self._dependants.setdefault(key, []).append(rule)
+
+    def start_tasks(self):
+        self.readings = Readings(self.host.components)
+        self.host.listeners.append(self.evaluate)
+        self.host.control_listeners.append(self.reapply)
+        super().start_tasks()
+
+    def process_control(self, message):
+        # All rules are compiled before any is changed, so a bad rule leaves the others as they were
+        rules = {name: Rule(name, spec) for name, spec in message.items() if spec is not None}
+        removed = [name for name, spec in message.items() if spec is None and self.rules.pop(name, None)]
+        self.rules.update(rules)
+        self._removed.update(removed)
+        self._removed.difference_update(rules)
+        self._index()
+        if rules or removed:
+            self.update_state()
+
+    def evaluate(self, area, name, values):
+        sampled = time.perf_counter()
+        dependants = {}
+        for prop, value in values.items():
+            key = f'{area}.{name}.{prop}'
+            self.readings[key] = value
+            dependants.update(dict.fromkeys(self._dependants.get(key, ())))
+        if not dependants:
+            return
+        now = self.loop.time()
+        for rule in dependants:
+            if rule.evaluate(self.readings, now):
+                self.fire(rule, sampled)
+
+    def reapply(self, area, message):
+        if self._applying:
+            return
+        for rule in self.rules.values():
+            if rule.active and area in rule.actions:
+                self._send(area, rule.actions[area])
+                if self.metrics is not None:
+                    self.metrics.count('reapplied')
+
+    def _send(self, area, message):
+        component = self.host.components.get(area)
+        if component is not None:
+            self._applying = True
+            try:
+                # Handlers keep or change the messages they get
+                self.host.handle(component, copy_state(message))
+            finally:
+                self._applying = False
+
+    def fire(self, rule, sampled):
+        for area, message in rule.actions.items():
+            self._send(area, message)
+        if self.metrics is not None:
+            self.metrics.count('firings')
+            self.metrics.time('reaction', time.perf_counter() - sampled)
+        print(f'rules: {rule.name} fired on {", ".join(f"{key} = {self.readings.get(key)}" for key in sorted(rule.keys))}')
+        self.update_state()
+
+    @property
+    def state(self):
+        # Removed rules stay in the state as None, so the clients merging deltas drop them as well
+        state = dict.fromkeys(self._removed)
+        state.update((name, rule.state) for name, rule in self.rules.items())
+        return state
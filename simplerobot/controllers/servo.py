@@ -1,72 +1,132 @@
+from simplerobot.controllers import drivers
 from simplerobot.mqtt import Component
-import asyncio
-
-try:
-    import Adafruit_PCA9685
-
-    pwm = Adafruit_PCA9685.PCA9685()
-    pwm.set_pwm_freq(50)
-except:
-    class PWMEmulator:
-        def set_pwm(self, servo, start, stop):
-            print(f"Servo {servo} Start {start} Stop {stop}")
-
-    pwm = PWMEmulator()
+from simplerobot.trajectory import TrajectoryPlanner
+import collections
+import numpy
+
+pwm_device = pwm = None
+
+
+@drivers
+def load_drivers():
+    try:
+        import Adafruit_PCA9685
+
+        pwm = Adafruit_PCA9685.PCA9685()
+        pwm.set_pwm_freq(50)
+        pwm_device = pwm._device
+    except:
+        class PWMEmulator:
+            # Records the register writes instead of talking to a PCA9685
+            def __init__(self):
+                self.registers = bytearray(256)
+                self.transactions = collections.deque(maxlen=1000)
+                self.write_count = 0
+
+            def set_pwm(self, servo, start, stop):
+                print(f"Servo {servo} Start {start} Stop {stop}")
+
+            def readU8(self, register):
+                return self.registers[register]
+
+            def write8(self, register, value):
+                self.writeList(register, [value])
+
+            def writeList(self, register, data):
+                self.registers[register:register + len(data)] = bytes(data)
+                self.transactions.append((register, list(data)))
+                self.write_count += 1
+
+        pwm = PWMEmulator()
+        pwm_device = pwm
+
+    return dict(pwm_device=pwm_device, pwm=pwm)
+
+
+class PWMOutput:
+    """Collects the PCA9685 channel changes of a tick and writes them with auto-increment block writes."""
+    MODE1 = 0x00
+    AUTO_INCREMENT = 0x20
+    LED0_ON_L = 0x06
+    # An I2C block write carries at most 32 bytes, 4 per channel
+    MAX_BLOCK_CHANNELS = 8
+    # Unchanged channels between two changed ones are rewritten when that is cheaper than a new transaction
+    MAX_GAP = 2
+
+    def __init__(self, device, channels=16):
+        self.device = device
+        self._values = [None] * channels
+        self._pending = {}
+        self.device.write8(PWMOutput.MODE1, self.device.readU8(PWMOutput.MODE1) | PWMOutput.AUTO_INCREMENT)
+
+    def set(self, channel, value):
+        if self._values[channel] == value:
+            self._pending.pop(channel, None)
+        else:
+            self._pending[channel] = value
+
+    def _runs(self):
+        run = []
+        for channel in sorted(self._pending):
+            if run:
+                gap = range(run[-1] + 1, channel)
+                if (channel - run[0] >= PWMOutput.MAX_BLOCK_CHANNELS or len(gap) > PWMOutput.MAX_GAP
+                        or any(self._values[c] is None for c in gap)):
+                    yield run[0], run[-1]
+                    run = []
+            run.append(channel)
+        if run:
+            yield run[0], run[-1]
+
+    def flush(self):
+        transactions = 0
+        for first, last in self._runs():
+            data = []
+            for channel in range(first, last + 1):
+                value = self._pending.get(channel, self._values[channel])
+                data += (0, 0, value & 0xff, value >> 8)
+                self._values[channel] = value
+            self.device.writeList(PWMOutput.LED0_ON_L + 4 * first, data)
+            transactions += 1
+        self._pending.clear()
+        return transactions
 
 
 class Servo:
-    def __init__(self, index, pwm_min, pwm_max, angle_range, angle_min, angle_max):
+    def __init__(self, planner, slot, output, index, pwm_min, pwm_max, angle_range, angle_min, angle_max):
+        self.planner = planner
+        self.slot = slot
+        self.output = output
         self.index = index
         self.pwm_min = pwm_min
         self.angle_range = angle_range
         self.pwm_multiplier = (pwm_max - pwm_min) / angle_range
         self.angle_min = angle_min
         self.angle_max = angle_max
-        self.state = 'idle'
-        self.angle = 0
-        self.target_angle = 0
         self.speed = 0
-        self.tick_count = 0
-        self.tick_count_divider = 0
         self.init_position()
 
     def init_position(self):
-        self.angle = 0
-        self.target_angle = 0
-        self.state = 'idle'
+        self.planner.reset(self.slot, 0)
         self.set_pwm(0)
 
-    def set_angle(self, angle, speed):
-        angle = max(min(angle, self.angle_max), self.angle_min)
-        self.target_angle = angle
-        self.speed = speed
-        self.tick_count_divider = 1.0 / speed
-        self.state = 'move' if angle != self.angle else 'idle'
-
-    def update_angle(self):
-        if self.state == 'idle':
-            return False
-        self.tick_count += 1
-        if self.tick_count >= self.tick_count_divider:
-            angle_change = int(self.tick_count / self.tick_count_divider)
-            self.tick_count = 0
-            if self.angle > self.target_angle:
-                self.angle -= angle_change
-                if self.angle < self.target_angle:
-                    self.angle = self.target_angle
-            elif self.angle < self.target_angle:
-                self.angle += angle_change
-                if self.angle > self.target_angle:
-                    self.angle = self.target_angle
-
-            self.set_pwm(self.angle)
-
-            if self.target_angle == self.angle:
-                self.state = 'idle'
-        return True
+    def clamp(self, angle):
+        return max(min(angle, self.angle_max), self.angle_min)
 
     def set_pwm(self, angle):
-        pwm.set_pwm(self.index, 0, self.pwm_min + int(self.pwm_multiplier * (angle + self.angle_range / 2)))
+        self.output.set(self.index, self.pwm_min + int(self.pwm_multiplier * (angle + self.angle_range / 2)))
+
+    @property
+    def angle(self):
+        return float(self.planner.position[self.slot])
+
+    @property
+    def target_angle(self):
+        return float(self.planner.target[self.slot])
+
+    @property
+    def state(self):
+        return 'move' if self.planner.active[self.slot] else 'idle'
 
     @property
     def state_dict(self):
@@ -75,39 +135,64 @@ class Servo:
 
 
 class ServoController(Component):
+    # Speeds are given in degrees per TICK, the period the servo positions are updated at
+    TICK = 0.037
+
     def __init__(self, config):
-        super().__init__("servos")
+        super().__init__("servos", config)
+        load_drivers()
         self.servos = {}
-        for index, servo in config['servos'].items():
+        self.planner = TrajectoryPlanner(len(config['servos']))
+        self.output = PWMOutput(pwm_device)
+        self.task = None
+        for slot, (index, servo) in enumerate(config['servos'].items()):
             pwm_details = servo['pwm']
             angle_details = servo['angle']
-            self.servos[servo['name']] = Servo(index, pwm_details['min'], pwm_details['max'],
-                                               angle_details['range'], angle_details['min'], angle_details['max'])
-
-    async def start(self):
-        asyncio.create_task(self.update_servos())
-        await super().start()
+            self.servos[servo['name']] = Servo(self.planner, slot, self.output, index, pwm_details['min'],
+                                               pwm_details['max'], angle_details['range'], angle_details['min'],
+                                               angle_details['max'])
+        self.output.flush()
+        servos = list(self.servos.values())
+        self._indexes = [servo.index for servo in servos]
+        self._pwm_min = numpy.array([servo.pwm_min for servo in servos])
+        self._pwm_multiplier = numpy.array([servo.pwm_multiplier for servo in servos])
+        self._half_range = numpy.array([servo.angle_range / 2 for servo in servos])
+
+    def start_tasks(self):
+        self.task = self.scheduler.every(f'{self.name}.tick', ServoController.TICK, self.update_servos)
+        self.task.park()
+        super().start_tasks()
 
     def process_control(self, message):
-        update = False
+        slots, targets, speeds = [], [], []
         for name, servo in self.servos.items():
             if name in message:
-                angle = message[name]['angle']
-                speed = message[name]['speed']
-                servo.set_angle(angle, speed)
-                update = True
-        if update:
+                servo.speed = message[name]['speed']
+                slots.append(servo.slot)
+                targets.append(servo.clamp(message[name]['angle']))
+                speeds.append(servo.speed / ServoController.TICK)
+        if slots:
+            self.planner.move(slots, targets, speeds, self.loop.time(), synchronise=message.get('sync', False))
+            self.write_pwm(slots)
             self.update_state()
-
-    async def update_servos(self):
-        while True:
-            need_state_update = False
-            for servo in self.servos.values():
-                if servo.update_angle():
-                    need_state_update = True
-            if need_state_update:
-                self.update_state()
-            await asyncio.sleep(0.037)
+            if self.task is not None and self.planner.active.any():
+                self.task.wake()
+
+    def write_pwm(self, slots):
+        values = (self._pwm_min[slots] + (self._pwm_multiplier[slots] *
+                                          (self.planner.position[slots] + self._half_range[slots])).astype(int))
+        for slot, value in zip(slots, values.tolist()):
+            self.output.set(self._indexes[slot], value)
+        self.output.flush()
+
+    def update_servos(self):
+        moved = self.planner.update(self.loop.time())
+        if len(moved):
+            self.write_pwm(moved)
+            self.update_state()
+        if not self.planner.active.any():
+            # Nothing moves any more, sleep until the next control message starts a move
+            self.task.park()
 
     @property
     def state(self):
@@ -0,0 +1,72 @@
+import collections
+import queue
+import threading
+import time
+import traceback
+
+
+class ObserverDispatcher:
+    """Calls the observers of state objects on worker threads instead of the network thread.
+
+    Every object has a bounded queue of pending updates, delivered in order and never to two
+    workers at once. With the 'all' policy an update is only dropped when the queue is full,
+    with 'latest' a pending update is replaced by the next one.
+    """
+    POLICIES = ('all', 'latest')
+
+    def __init__(self, policy='all', queue_size=100, workers=1, late_after=0.1):
+        if policy not in ObserverDispatcher.POLICIES:
+            raise ValueError(f'Unknown observer policy "{policy}"')
+        self.policy = policy
+        self.queue_size = 1 if policy == 'latest' else queue_size
+        self.late_after = late_after
+        self.delivered = 0
+        self.dropped = 0
+        self.late = 0
+        self._pending = {}
+        self._ready = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._work, name=f'observers-{index}', daemon=True)
+                         for index in range(workers)]
+        self._started = False
+
+    def submit(self, obj, snapshot):
+        with self._lock:
+            if not self._started:
+                self._started = True
+                for worker in self._workers:
+                    worker.start()
+            pending = self._pending.get(obj)
+            if pending is None:
+                pending = self._pending[obj] = collections.deque()
+                self._ready.put(obj)
+            if len(pending) >= self.queue_size:
+                pending.popleft()
+                self.dropped += 1
+            pending.append((time.monotonic(), snapshot))
+
+    def _work(self):
+        while True:
+            obj = self._ready.get()
+            with self._lock:
+                queued, snapshot = self._pending[obj].popleft()
+            late = time.monotonic() - queued > self.late_after
+            for observer in list(obj._observers):
+                try:
+                    observer(snapshot)
+                except Exception:
+                    traceback.print_exc()
+            with self._lock:
+                self.delivered += 1
+                if late:
+                    self.late += 1
+                if self._pending[obj]:
+                    self._ready.put(obj)
+                else:
+                    del self._pending[obj]
+
+    @property
+    def statistics(self):
+        with self._lock:
+            return dict(delivered=self.delivered, dropped=self.dropped, late=self.late,
+                        pending=sum(len(pending) for pending in self._pending.values()))
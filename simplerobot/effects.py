@@ -0,0 +1,145 @@
+import numpy
+
+
+class EffectError(Exception):
+    pass
+
+
+class Effect:
+    """Renders into the rows of an RGB frame (float, 0-255) that belong to its LEDs.
+
+    Every effect takes an optional 'duration' in seconds after which it finishes; the LEDs then
+    keep the colours of the last frame.
+    """
+    name = None
+
+    def __init__(self, spec: dict, indexes, frame: numpy.ndarray, start: float):
+        self.indexes = numpy.asarray(indexes, dtype=int)
+        self.start = start
+        self.duration = spec.get('duration')
+
+    def render(self, now: float, frame: numpy.ndarray) -> bool:
+        # Returns True when the effect finished
+        t = now - self.start
+        if self.duration is not None and t >= self.duration:
+            t = self.duration
+        self._render(t, frame)
+        return self.duration is not None and t >= self.duration
+
+    def _render(self, t: float, frame: numpy.ndarray):
+        raise NotImplementedError
+
+
+def _color(spec, key, default=(0, 0, 0)):
+    value = spec.get(key, default)
+    if len(value) != 3:
+        raise EffectError(f'"{key}" must be [red, green, blue]')
+    return numpy.asarray(value, dtype=float)
+
+
+class Chase(Effect):
+    """'width' LEDs of 'color' step along the LEDs every 'period' seconds over 'background'."""
+    name = 'chase'
+
+    def __init__(self, spec, indexes, frame, start):
+        super().__init__(spec, indexes, frame, start)
+        self.color = _color(spec, 'color', (255, 255, 255))
+        self.background = _color(spec, 'background')
+        self.period = float(spec.get('period', 0.1))
+        self.width = int(spec.get('width', 1))
+
+    def _render(self, t, frame):
+        count = len(self.indexes)
+        position = int(t / self.period)
+        frame[self.indexes] = self.background
+        frame[self.indexes[(position + numpy.arange(self.width)) % count]] = self.color
+
+
+class Pulse(Effect):
+    """Brightness of 'color' breathing between 'min' and 1 with the given 'period'."""
+    name = 'pulse'
+
+    def __init__(self, spec, indexes, frame, start):
+        super().__init__(spec, indexes, frame, start)
+        self.color = _color(spec, 'color', (255, 255, 255))
+        self.period = float(spec.get('period', 2.0))
+        self.min = float(spec.get('min', 0.0))
+
+    def _render(self, t, frame):
+        level = self.min + (1 - self.min) * (0.5 - 0.5 * numpy.cos(2 * numpy.pi * t / self.period))
+        frame[self.indexes] = self.color * level
+
+
+class Gradient(Effect):
+    """'from' to 'to' along the LEDs, scrolling round once every 'period' seconds when given."""
+    name = 'gradient'
+
+    def __init__(self, spec, indexes, frame, start):
+        super().__init__(spec, indexes, frame, start)
+        self.first = _color(spec, 'from')
+        self.last = _color(spec, 'to', (255, 255, 255))
+        self.period = spec.get('period')
+        self.ramp = numpy.linspace(0.0, 1.0, len(self.indexes), endpoint=self.period is None)
+
+    def _render(self, t, frame):
+        ramp = self.ramp
+        if self.period:
+            # A triangle, so the colours wrap round without a jump
+            ramp = 1 - numpy.abs(2 * ((ramp + t / float(self.period)) % 1.0) - 1)
+        frame[self.indexes] = self.first + (self.last - self.first) * ramp[:, None]
+
+
+class Keyframes(Effect):
+    """'frames' is a list of {'t': seconds, 'leds': {name: [red, green, blue]}}. LEDs not given in
+    a frame keep their colour from the frame before, or from before the effect for the first one.
+    With 'interpolate' the colours fade from frame to frame, with 'loop' the frames repeat."""
+    name = 'keyframes'
+
+    def __init__(self, spec, indexes, frame, start, names=None):
+        super().__init__(spec, indexes, frame, start)
+        frames = sorted(spec.get('frames', []), key=lambda keyframe: keyframe['t'])
+        if not frames:
+            raise EffectError('A keyframes effect needs frames')
+        self.times = numpy.array([float(keyframe['t']) for keyframe in frames])
+        self.colors = numpy.empty((len(frames), len(self.indexes), 3))
+        rows = {index: row for row, index in enumerate(self.indexes.tolist())}
+        current = frame[self.indexes].copy()
+        for number, keyframe in enumerate(frames):
+            for name, color in keyframe.get('leds', {}).items():
+                row = rows.get(names.get(name) if names else name)
+                if row is not None:
+                    current[row] = color
+            self.colors[number] = current
+        self.interpolate = bool(spec.get('interpolate', True))
+        self.loop = bool(spec.get('loop', False))
+        if self.duration is None and not self.loop:
+            self.duration = self.times[-1]
+
+    def _render(self, t, frame):
+        if self.loop and self.times[-1] > 0:
+            t %= self.times[-1]
+        number = max(int(numpy.searchsorted(self.times, t, side='right')) - 1, 0)
+        color = self.colors[number]
+        if self.interpolate and number + 1 < len(self.times) and t > self.times[number]:
+            span = self.times[number + 1] - self.times[number]
+            fraction = (t - self.times[number]) / span if span > 0 else 1.0
+            color = color + (self.colors[number + 1] - color) * fraction
+        frame[self.indexes] = color
+
+
+EFFECTS = {effect.name: effect for effect in (Chase, Pulse, Gradient, Keyframes)}
+
+
+def create_effect(spec: dict, names: dict, frame: numpy.ndarray, start: float) -> Effect:
+    """names maps the LED names to their index in the frame. spec['leds'] picks the LEDs of the
+    effect, in order; all named LEDs by default."""
+    effect_class = EFFECTS.get(spec.get('type'))
+    if effect_class is None:
+        raise EffectError(f'Unknown LED effect "{spec.get("type")}"')
+    leds = spec.get('leds') or sorted(names, key=names.get)
+    indexes = [names[name] for name in leds if name in names]
+    if not indexes:
+        raise EffectError('The effect has no LEDs')
+    if effect_class is Keyframes:
+        return Keyframes(spec, indexes, frame, start, names)
+    return effect_class(spec, indexes, frame, start)
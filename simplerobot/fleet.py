@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+import traceback
+import paho.mqtt.client as mqtt
+from .client import Robot, ConnectTimeout
+from .codec import JSONCodec
+from .dispatch import ObserverDispatcher
+from .utils import get_mqtt_connection_details
+
+
+class Fleet:
+    """Many robots over one MQTT connection, e.g.
+
+        fleet = Fleet(['robot1', 'robot2'])
+        fleet.connect()
+        fleet['robot1'].forward()
+        fleet.wait(fleet.broadcast('motors', {'left': 0, 'right': 0}))
+
+    Every robot is a Robot view keyed by the prefix its srcontroller publishes under (see the
+    'prefix' setting). The fleet subscribes to the state of those prefixes and routes the messages to
+    the views on its network thread; observers of all the robots share one worker thread. With
+    prefixes None it subscribes to every prefix, and robots are added as they are first heard from
+    and on_robot(robot) is called.
+    """
+
+    def __init__(self, prefixes=None, codec=None, history: dict = None, command_timeout: float = 5.0,
+                 observers='all', streams=False, on_robot=None):
+        self.codec = codec if codec is not None else JSONCodec()
+        self.history = history
+        self.command_timeout = command_timeout
+        self.dispatcher = None if observers == 'sync' else ObserverDispatcher(observers)
+        self.streams = streams
+        self.on_robot = on_robot
+        self.discover = prefixes is None
+        self.robots = {}
+        self._lock = threading.Lock()
+        client = mqtt.Client()
+        client.on_connect = self._on_connect
+        client.on_message = self._on_message
+        self._client = client
+        for prefix in prefixes or ():
+            self._add(prefix)
+
+    def __getitem__(self, prefix) -> Robot:
+        return self.robots[prefix]
+
+    def __iter__(self):
+        return iter(list(self.robots.values()))
+
+    def __len__(self):
+        return len(self.robots)
+
+    def _add(self, prefix):
+        with self._lock:
+            robot = self.robots.get(prefix)
+            if robot is None:
+                robot = Robot(self.codec, self.history, self.command_timeout,
+                              self.dispatcher if self.dispatcher is not None else 'sync',
+                              prefix=prefix, client=self._client)
+                # Copied, so the network thread can iterate the robots without the lock
+                self.robots = {**self.robots, prefix: robot}
+                return robot, True
+        return robot, False
+
+    def connect(self, url=None, timeout: float = 10.0):
+        # Returns once every robot given on creation reported its state, raises ConnectTimeout after timeout seconds
+        if url is None:
+            url = os.environ.get('SIMPLEROBOT_MQTT_HOST', "mqtt://localhost")
+        host, kwargs = get_mqtt_connection_details(url)
+        self._client.connect(host, **kwargs)
+        self._client.loop_start()
+        deadline = time.monotonic() + timeout
+        for robot in self.robots.values():
+            if not robot.init_event.wait(max(deadline - time.monotonic(), 0)):
+                waiting = [prefix for prefix, robot in self.robots.items() if not robot.init_event.is_set()]
+                raise ConnectTimeout(f'No state received from {", ".join(waiting)}')
+
+    def disconnect(self):
+        self._client.loop_stop()
+        self._client.disconnect()
+
+    def broadcast(self, area: str, message: dict, prefixes=None) -> dict:
+        """Sends the control message to every robot, or to the given ones, and returns their Commands
+        by prefix, e.g. fleet.broadcast('leds', {'effect': {'type': 'pulse', 'color': [0, 0, 255]}})"""
+        robots = self.robots if prefixes is None else {prefix: self.robots[prefix] for prefix in prefixes}
+        # Every robot gets its own copy, tagged with its own command id
+        return {prefix: robot._send_command(area, dict(message)) for prefix, robot in robots.items()}
+
+    def wait(self, commands: dict, timeout: float = None) -> dict:
+        # Waits for the commands of a broadcast and returns the latency of each, raises CommandTimeout
+        return {prefix: command.wait(timeout) for prefix, command in commands.items() if command is not None}
+
+    def _on_connect(self, client, *args):
+        kinds = ('state', 'stream') if self.streams else ('state',)
+        prefixes = ['+'] if self.discover else list(self.robots)
+        client.subscribe([(f'{prefix}/+/{kind}', 0) for prefix in prefixes for kind in kinds])
+
+    def _on_message(self, client, userdata, msg):
+        topic = msg.topic
+        prefix = topic[:topic.find('/')]
+        robot = self.robots.get(prefix)
+        added = False
+        if robot is None:
+            if not self.discover:
+                return
+            robot, added = self._add(prefix)
+        try:
+            robot._process_message(topic, msg.payload)
+        except Exception:
+            # Other devices may publish on the broker too, a bad message must not stop the network thread
+            traceback.print_exc()
+            if added:
+                # Not a robot after all
+                with self._lock:
+                    self.robots = {key: value for key, value in self.robots.items() if key != prefix}
+            return
+        if added and self.on_robot is not None:
+            self.on_robot(robot)
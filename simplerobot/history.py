@@ -0,0 +1,66 @@
+import numpy
+
+
+class History:
+    """Bounded ring of timestamped values, one column per property, allocated once."""
+
+    def __init__(self, properties, size: int):
+        self.properties = tuple(properties)
+        self.size = size
+        self.count = 0
+        self._columns = {name: column for column, name in enumerate(self.properties)}
+        self._timestamps = numpy.zeros(size)
+        self._values = numpy.full((size, len(self.properties)), numpy.nan)
+        self._index = 0
+
+    def append(self, timestamp: float, state: dict):
+        row = self._values[self._index]
+        for column, name in enumerate(self.properties):
+            value = state.get(name)
+            row[column] = numpy.nan if value is None else value
+        self._timestamps[self._index] = timestamp
+        self._index = (self._index + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def _ordered(self, array, count):
+        # The last `count` entries, oldest first
+        start = self._index - count
+        if start >= 0:
+            return array[start:self._index]
+        return numpy.concatenate((array[start:], array[:self._index]))
+
+    def _select(self, values, prop):
+        if prop is None:
+            return values
+        return values[:, self._columns[prop]]
+
+    def last(self, count: int = None, prop: str = None):
+        count = self.count if count is None else min(count, self.count)
+        return self._ordered(self._timestamps, count), self._select(self._ordered(self._values, count), prop)
+
+    def since(self, timestamp: float, prop: str = None):
+        timestamps, values = self.last()
+        start = numpy.searchsorted(timestamps, timestamp, side='left')
+        return timestamps[start:], self._select(values[start:], prop)
+
+    def window(self, seconds: float = None, prop: str = None):
+        if seconds is None:
+            return self.last(prop=prop)[1]
+        latest = self._timestamps[self._index - 1] if self.count else 0.0
+        return self.since(latest - seconds, prop)[1]
+
+    def mean(self, seconds: float = None, prop: str = None):
+        return numpy.nanmean(self.window(seconds, prop), axis=0)
+
+    def min(self, seconds: float = None, prop: str = None):
+        return numpy.nanmin(self.window(seconds, prop), axis=0)
+
+    def max(self, seconds: float = None, prop: str = None):
+        return numpy.nanmax(self.window(seconds, prop), axis=0)
+
+    def var(self, seconds: float = None, prop: str = None):
+        return numpy.nanvar(self.window(seconds, prop), axis=0)
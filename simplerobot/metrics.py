@@ -0,0 +1,85 @@
+import collections
+import os
+import time
+
+DEFAULT_INTERVAL = 10.0
+
+
+class Histogram:
+    """Durations in power of two buckets of microseconds: bucket i holds the durations below 2**i µs."""
+    BUCKETS = 24
+
+    def __init__(self):
+        self.counts = [0] * Histogram.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self.counts[min(int(seconds * 1e6).bit_length(), Histogram.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction: float) -> float:
+        # Upper bound of the bucket, in seconds
+        remaining = fraction * self.count
+        for bucket, count in enumerate(self.counts):
+            remaining -= count
+            if remaining <= 0 and count:
+                return min(2 ** bucket / 1e6, self.max)
+        return self.max
+
+    def as_dict(self):
+        last = max((bucket for bucket, count in enumerate(self.counts) if count), default=-1)
+        return dict(count=self.count, mean_ms=self.total / self.count * 1000 if self.count else 0.0,
+                    p50_ms=self.percentile(0.5) * 1000, p99_ms=self.percentile(0.99) * 1000, max_ms=self.max * 1000,
+                    buckets=self.counts[:last + 1])
+
+
+class Metrics:
+    """Counters, gauges and duration histograms of a component or client.
+
+    The code being measured keeps `metrics = None` when metrics are disabled and checks it
+    before measuring, so disabled metrics cost one attribute test.
+    """
+
+    def __init__(self):
+        self.counters = collections.Counter()
+        self.gauges = {}
+        self.histograms = collections.defaultdict(Histogram)
+        self.started = time.time()
+
+    def count(self, name: str, value=1):
+        self.counters[name] += value
+
+    def gauge(self, name: str, value):
+        self.gauges[name] = value
+
+    def add(self, name: str, value):
+        # For gauges that go up and down, the maximum is kept as well
+        value = self.gauges.get(name, 0) + value
+        self.gauges[name] = value
+        if value > self.gauges.get(f'{name}_max', 0):
+            self.gauges[f'{name}_max'] = value
+
+    def time(self, name: str, seconds: float):
+        self.histograms[name].record(seconds)
+
+    def snapshot(self, reset=False) -> dict:
+        snapshot = dict(since=self.started, counters=dict(self.counters), gauges=dict(self.gauges),
+                        histograms={name: histogram.as_dict() for name, histogram in list(self.histograms.items())})
+        if reset:
+            self.counters.clear()
+            self.histograms.clear()
+            self.started = time.time()
+        return snapshot
+
+
+def metrics_settings(config: dict) -> dict:
+    settings = (config or {}).get('metrics') or {}
+    enabled = settings.get('enabled', False)
+    if 'SIMPLEROBOT_METRICS' in os.environ:
+        enabled = os.environ['SIMPLEROBOT_METRICS'].lower() in ('1', 'true', 'yes', 'on')
+    return dict(enabled=bool(enabled), interval=float(settings.get('interval', DEFAULT_INTERVAL)))
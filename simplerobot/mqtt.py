@@ -1,37 +1,142 @@
-import json
 import asyncio_mqtt
 import asyncio
+import json
 import os
+import threading
+import time
+import traceback
 from urllib.parse import urlparse
-from .utils import get_mqtt_connection_details
+from .utils import get_mqtt_connection_details, copy_state, merge_state, state_delta, topic_prefix
+from .codec import get_codec
+from .scheduler import Scheduler
+from .metrics import Metrics, metrics_settings
 
 
 class Component:
-    def __init__(self, name):
+    def __init__(self, name, config=None):
         self.name = name
-        self.client = None
+        self.codec = get_codec(config)
+        self.transport = None
         self.loop = None
+        self.scheduler = None
+        self.host = None
+        publish_config = (config or {}).get('publish', {})
+        self.delta = publish_config.get('delta', False)
+        self.keyframe_deltas = publish_config.get('keyframe_deltas', 20)
+        self.keyframe_interval = publish_config.get('keyframe_interval', 5.0)
+        self._published_state = None
+        self._deltas_since_keyframe = 0
+        self._keyframe_time = 0.0
+        self._state_lock = threading.Lock()
+        self._ack = None
+        settings = metrics_settings(config)
+        # None when disabled, see Metrics
+        self.metrics = Metrics() if settings['enabled'] else None
+        self.metrics_interval = settings['interval']
 
     async def start(self):
-        self.loop = asyncio.get_event_loop()
-        url = os.environ.get('SIMPLEROBOT_MQTT_HOST', "mqtt://localhost")
-        host, kwargs = get_mqtt_connection_details(url)
-        async with asyncio_mqtt.Client(host, **kwargs) as client:
-            self.client = client
+        # Runs this component on a connection of its own, see ControllerHost to share one
+        await ControllerHost([self]).run()
+
+    def attach(self, transport, loop, scheduler):
+        self.transport = transport
+        self.loop = loop
+        self.scheduler = scheduler
+        self.update_state()
+        self.start_tasks()
+
+    def start_tasks(self):
+        if self.delta:
+            self.scheduler.every(f'{self.name}.keyframes', self.keyframe_interval, self._publish_keyframe)
+        if self.metrics is not None:
+            self.scheduler.every(f'{self.name}.metrics', self.metrics_interval, self.publish_metrics)
+
+    def handle_control(self, message):
+        # The id of the command is echoed as '_ack' in the next state publish, which is forced
+        # when processing the command did not publish anything
+        self._ack = message.pop('_id', None)
+        try:
+            if self.metrics is None:
+                self.process_control(message)
+            else:
+                started = time.perf_counter()
+                self.process_control(message)
+                self.metrics.time('process_control', time.perf_counter() - started)
+                self.metrics.count('controls')
+        except Exception:
+            # A command that failed is not acknowledged, so it times out on the client
+            self._ack = None
+            raise
+        if self._ack is not None:
             self.update_state()
-            topic = f"robot/{self.name}/ctrl"
-            async with client.filtered_messages(topic) as messages:
-                await client.subscribe(topic)
-                async for message in messages:
-                    self.process_control(json.loads(message.payload.decode()))
+        if self.host is not None:
+            for listener in self.host.control_listeners:
+                listener(self.name, message)
 
-    def update_state(self, thread_safe=False):
-        message = json.dumps(self.state)
-        future = self.client.publish(f"robot/{self.name}/state", message, retain=True)
-        if thread_safe:
-            asyncio.run_coroutine_threadsafe(future, self.loop)
-        else:
-            asyncio.create_task(future)
+    def update_state(self, thread_safe=False, keyframe=False):
+        with self._state_lock:
+            message, retain = self._next_state_message(keyframe)
+            ack, self._ack = self._ack, None
+            if ack is not None and not retain:
+                message, ack = dict(message, _ack=ack), None
+        published = self.transport.publish_state(self, message, retain, thread_safe)
+        if ack is not None:
+            # The broker would hand a retained ack to every client that subscribes later
+            self.transport.publish_state(self, {'_ack': ack}, False, thread_safe)
+        if self.metrics is not None:
+            self.metrics.count('keyframes' if retain else 'deltas')
+            self._track(published)
+
+    def publish_stream(self, frame: bytes):
+        published = self.transport.publish_stream(self, frame)
+        if self.metrics is not None:
+            self.metrics.count('stream_frames')
+            self._track(published)
+
+    def _track(self, published):
+        # Publishes handed to the transport that did not complete yet
+        if published is not None:
+            self.metrics.add('pending_publishes', 1)
+            published.add_done_callback(lambda _: self.metrics.add('pending_publishes', -1))
+
+    def metrics_snapshot(self, reset=False):
+        snapshot = self.metrics.snapshot(reset)
+        prefix = f'{self.name}.'
+        snapshot['tasks'] = {name: statistics for name, statistics in self.scheduler.statistics().items()
+                             if name.startswith(prefix)}
+        return snapshot
+
+    def publish_metrics(self):
+        self.transport.publish_metrics(self, self.metrics_snapshot(reset=True))
+
+    def _next_state_message(self, keyframe):
+        # Returns the message to publish and whether the broker should retain it. Only full
+        # snapshots are retained, so a new subscriber always starts from a complete state.
+        state = self.state
+        if not self.delta:
+            return state, True
+        now = self.loop.time()
+        if (keyframe or self._published_state is None or self._deltas_since_keyframe >= self.keyframe_deltas
+                or now - self._keyframe_time >= self.keyframe_interval):
+            self._published_state = copy_state(state)
+            self._deltas_since_keyframe = 0
+            self._keyframe_time = now
+            return state, True
+        delta = state_delta(self._published_state, state)
+        merge_state(self._published_state, delta)
+        self._deltas_since_keyframe += 1
+        return delta, False
+
+    def _publish_keyframe(self):
+        # Makes sure the retained snapshot catches up with the deltas even when updates stop
+        if self._deltas_since_keyframe and self.loop.time() - self._keyframe_time >= self.keyframe_interval:
+            self.update_state(keyframe=True)
+
+    def notify_reading(self, name: str, values: dict):
+        # Hands a sensor reading to the listeners of the host, e.g. the rules, on the loop
+        if self.host is not None:
+            for listener in self.host.listeners:
+                listener(self.name, name, values)
 
     def process_control(self, message):
         pass
@@ -40,3 +145,119 @@ class Component:
     # @property
     # def state(self):
     #     return {}
+
+
+class MQTTTransport:
+    # Controller side of MQTT, messages are encoded with the codec of the component
+    def __init__(self, client, loop, prefix='robot'):
+        self.client = client
+        self.loop = loop
+        self.prefix = prefix
+
+    def publish_state(self, component, message: dict, retain, thread_safe=False):
+        payload = component.codec.encode(component.name, message)
+        if component.metrics is not None:
+            component.metrics.count('state_bytes', len(payload))
+        return self._publish(f"{self.prefix}/{component.name}/state", payload, retain, thread_safe)
+
+    def publish_stream(self, component, frame: bytes):
+        if component.metrics is not None:
+            component.metrics.count('stream_bytes', len(frame))
+        return self._publish(f"{self.prefix}/{component.name}/stream", frame, False, False)
+
+    def publish_metrics(self, component, metrics: dict):
+        # Always JSON, the codecs only describe state and control messages
+        return self._publish(f"{self.prefix}/{component.name}/metrics", json.dumps(metrics).encode(), False, False)
+
+    def _publish(self, topic, payload, retain, thread_safe):
+        future = self.client.publish(topic, payload, retain=retain)
+        if thread_safe:
+            return asyncio.run_coroutine_threadsafe(future, self.loop)
+        return asyncio.create_task(future)
+
+
+class ControllerHost:
+    def __init__(self, components=(), transport=None, prefix: str = None):
+        # transport: None for MQTT, or e.g. a LocalTransport shared with clients in the same process.
+        # Components can also be added once the host runs, see add and StartupPipeline. prefix: the
+        # first level of the topics, see topic_prefix
+        self.components = {component.name: component for component in components}
+        self.transport = transport
+        self.prefix = prefix if prefix is not None else topic_prefix()
+        self.client = None
+        self.scheduler = Scheduler()
+        # Called with (area, name, values) for every sensor reading, see Component.notify_reading
+        self.listeners = []
+        # Called with (area, message) after a component handled a control message, e.g. by the rules
+        self.control_listeners = []
+        # Set once the host serves control messages
+        self.ready = asyncio.Event()
+        self.connect_time = None
+        self._attached_to = None
+        # The control topic subscribed to, see control_topic
+        self._subscribed = None
+        self._subscribing = None
+
+    async def run(self):
+        if self.transport is not None:
+            await self.transport.serve(self)
+            return
+        url = os.environ.get('SIMPLEROBOT_MQTT_HOST', "mqtt://localhost")
+        host, kwargs = get_mqtt_connection_details(url)
+        started = time.perf_counter()
+        async with asyncio_mqtt.Client(host, **kwargs) as client:
+            self.client = client
+            self.start_components(MQTTTransport(client, asyncio.get_running_loop(), self.prefix))
+            self._subscribed = self.control_topic
+            async with client.filtered_messages(f"{self.prefix}/+/ctrl") as messages:
+                await client.subscribe(self._subscribed)
+                self.connect_time = time.perf_counter() - started
+                self.ready.set()
+                async for message in messages:
+                    self.dispatch(message.topic, message.payload)
+
+    def start_components(self, transport):
+        self._attached_to = transport
+        for component in self.components.values():
+            component.host = self
+            component.attach(transport, transport.loop, self.scheduler)
+
+    def add(self, component):
+        # Starts a component on a host that may already run, on the loop of the host
+        self.components[component.name] = component
+        component.host = self
+        if self._attached_to is not None:
+            component.attach(self._attached_to, self._attached_to.loop, self.scheduler)
+        if self._subscribed is not None and self._subscribed != self.control_topic:
+            # A host that started with one component only subscribed to the control topic of that one
+            self._subscribed = self.control_topic
+            self._subscribing = asyncio.ensure_future(self.client.subscribe(self._subscribed))
+
+    @property
+    def control_topic(self):
+        # A host of one component, e.g. started with Component.start, only gets the messages for that one
+        if len(self.components) == 1:
+            return f"{self.prefix}/{next(iter(self.components))}/ctrl"
+        return f"{self.prefix}/+/ctrl"
+
+    def dispatch(self, topic, payload):
+        component = self.components.get(topic.split('/')[-2])
+        if component is None:
+            return
+        try:
+            component.handle_control(component.codec.decode(component.name, payload))
+        except Exception:
+            # A bad message for one controller must not stop the others
+            traceback.print_exc()
+
+    def metrics(self):
+        return {name: component.metrics_snapshot() for name, component in self.components.items()
+                if component.metrics is not None}
+
+    @staticmethod
+    def handle(component, message: dict):
+        # Control messages that are already decoded, see LocalTransport
+        try:
+            component.handle_control(message)
+        except Exception:
+            traceback.print_exc()
@@ -0,0 +1,200 @@
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import paho.mqtt.client as mqtt
+from .utils import get_mqtt_connection_details, topic_prefix
+
+MAGIC = b'SRLOG1\n'
+RECORD = struct.Struct('<dHI')  # timestamp, topic length, payload length
+INDEX = struct.Struct('<dQ')  # timestamp, offset of the first record at or after it
+INDEX_INTERVAL = 1.0
+
+
+class RecordingError(Exception):
+    pass
+
+
+def index_filename(filename):
+    return filename + '.idx'
+
+
+class LogWriter:
+    """Append-only log of MQTT messages, with a sparse time index in a file next to it."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        new = not os.path.exists(filename) or os.path.getsize(filename) == 0
+        self._log = open(filename, 'ab')
+        self._index = open(index_filename(filename), 'ab')
+        if new:
+            self._log.write(MAGIC)
+        self._offset = self._log.tell()
+        self._indexed = None
+        self._lock = threading.Lock()
+
+    def write(self, timestamp, topic, payload):
+        encoded_topic = topic.encode()
+        with self._lock:
+            if self._indexed is None or timestamp - self._indexed >= INDEX_INTERVAL:
+                # The records an index entry points to are written out first, so a reader of a
+                # log that is still being recorded never seeks past its end
+                self._log.flush()
+                self._index.write(INDEX.pack(timestamp, self._offset))
+                self._index.flush()
+                self._indexed = timestamp
+            self._log.write(RECORD.pack(timestamp, len(encoded_topic), len(payload)))
+            self._log.write(encoded_topic)
+            self._log.write(payload)
+            self._offset += RECORD.size + len(encoded_topic) + len(payload)
+
+    def close(self):
+        with self._lock:
+            self._log.close()
+            self._index.close()
+
+
+class LogReader:
+    """Memory-mapped view of a log; seeking to a time is a binary search in the index."""
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self._log = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._log[:len(MAGIC)] != MAGIC:
+            raise RecordingError(f'{filename} is not a simplerobot log')
+        try:
+            with open(index_filename(filename), 'rb') as f:
+                self._index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # A missing or empty index just means reading from the start
+            self._index = b''
+        self._index_count = len(self._index) // INDEX.size
+
+    def close(self):
+        self._log.close()
+        if isinstance(self._index, mmap.mmap):
+            self._index.close()
+
+    def _index_entry(self, position):
+        return INDEX.unpack_from(self._index, position * INDEX.size)
+
+    def offset(self, timestamp):
+        # Offset of a record at or before the first record at `timestamp`
+        low, high = 0, self._index_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._index_entry(middle)[0] <= timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return self._index_entry(low - 1)[1] if low else len(MAGIC)
+
+    @property
+    def start_time(self):
+        return next(self.read(), (None,))[0]
+
+    def read(self, start=None, end=None):
+        """Yields (timestamp, topic, payload) from `start` up to `end`, payloads are memoryviews on the log."""
+        view = memoryview(self._log)
+        offset = len(MAGIC) if start is None else self.offset(start)
+        size = len(self._log)
+        while offset + RECORD.size <= size:
+            timestamp, topic_length, payload_length = RECORD.unpack_from(self._log, offset)
+            offset += RECORD.size
+            topic = bytes(view[offset:offset + topic_length]).decode()
+            offset += topic_length
+            payload = view[offset:offset + payload_length]
+            offset += payload_length
+            if start is not None and timestamp < start:
+                continue
+            if end is not None and timestamp > end:
+                return
+            yield timestamp, topic, payload
+
+
+class Recorder:
+    """Records every message of a robot. The timestamps are the wall time at the start of the
+    recording plus the time.monotonic() time since, so they only go forward and the time index
+    stays sorted when the system clock is set."""
+
+    def __init__(self, filename, prefix: str = None):
+        self.writer = LogWriter(filename)
+        self._epoch = time.time() - time.monotonic()
+        self.topic_prefix = prefix if prefix is not None else topic_prefix()
+        client = mqtt.Client()
+        client.on_connect = self._on_connect
+        client.on_message = self._on_message
+        self._client = client
+
+    def start(self, url=None):
+        if url is None:
+            url = os.environ.get('SIMPLEROBOT_MQTT_HOST', "mqtt://localhost")
+        host, kwargs = get_mqtt_connection_details(url)
+        self._client.connect(host, **kwargs)
+        self._client.loop_start()
+
+    def stop(self):
+        self._client.loop_stop()
+        self._client.disconnect()
+        self.writer.close()
+
+    def _on_connect(self, client, *args):
+        client.subscribe(f'{self.topic_prefix}/#')
+
+    def _on_message(self, client, userdata, msg):
+        self.writer.write(self._epoch + time.monotonic(), msg.topic, msg.payload)
+
+
+class Replayer:
+    """Feeds the state and stream messages of a log to a robot, e.g. a Robot() that is not connected.
+    speed is the replay rate relative to real time, None replays as fast as possible."""
+
+    def __init__(self, reader: LogReader, robot, speed=1.0):
+        self.reader = reader
+        self.robot = robot
+        self.speed = speed
+
+    def run(self, start=None, end=None):
+        first = None
+        started = time.monotonic()
+        count = 0
+        for timestamp, topic, payload in self.reader.read(start, end):
+            if not topic.endswith(('/state', '/stream')):
+                continue
+            if self.speed:
+                if first is None:
+                    first = timestamp
+                delay = (timestamp - first) / self.speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            self.robot._process_message(topic, bytes(payload))
+            count += 1
+        return count
+
+
+def main(arguments):
+    if len(arguments) < 2 or arguments[0] not in ('record', 'info'):
+        print('usage: python -m simplerobot.recording record|info <log file>')
+        return 1
+    command, filename = arguments[:2]
+    if command == 'record':
+        recorder = Recorder(filename)
+        recorder.start()
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            recorder.stop()
+    else:
+        reader = LogReader(filename)
+        count = end = 0
+        for end, _, _ in reader.read():
+            count += 1
+        print(f'{count} messages from {reader.start_time} to {end}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
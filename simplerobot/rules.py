@@ -0,0 +1,87 @@
+import ast
+
+_OPERATORS = (ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.Compare, ast.Lt,
+              ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq, ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div,
+              ast.Constant, ast.Load)
+
+
+class RuleError(Exception):
+    pass
+
+
+class _Readings(ast.NodeTransformer):
+    # Replaces area.name.property with a lookup of 'area.name.property' in the readings
+    def __init__(self):
+        self.keys = set()
+
+    def visit_Attribute(self, node):
+        parts = []
+        value = node
+        while isinstance(value, ast.Attribute):
+            parts.append(value.attr)
+            value = value.value
+        if not isinstance(value, ast.Name) or len(parts) != 2:
+            raise RuleError(f'Readings are written as area.name.property, not "{ast.unparse(node)}"')
+        key = '.'.join([value.id] + parts[::-1])
+        self.keys.add(key)
+        return ast.copy_location(ast.Subscript(ast.Name('_readings', ast.Load()), ast.Constant(key), ast.Load()), node)
+
+    def generic_visit(self, node):
+        if not isinstance(node, _OPERATORS + (ast.Attribute, ast.Name)):
+            raise RuleError(f'{type(node).__name__} is not allowed in a rule condition')
+        if isinstance(node, ast.Name):
+            raise RuleError(f'Readings are written as area.name.property, not "{node.id}"')
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise RuleError(f'Only numbers are allowed in a rule condition, not {node.value!r}')
+        return super().generic_visit(node)
+
+
+class Rule:
+    """A condition on sensor readings and the control messages sent when it becomes true, e.g.
+
+        Rule('front_stop', {'when': 'distancesensors.front.distance < 0.15',
+                            'do': {'motors': {'left': 0, 'right': 0}}})
+
+    The condition is compiled once. It compares readings, written as area.name.property, with
+    numbers and can combine comparisons with and, or and not. A rule fires when its condition
+    becomes true, and again every 'repeat' seconds while it stays true when that is given.
+    """
+
+    def __init__(self, name: str, spec: dict):
+        self.name = name
+        self.condition = spec.get('when')
+        self.actions = spec.get('do') or {}
+        self.repeat = spec.get('repeat')
+        if not isinstance(self.condition, str):
+            raise RuleError(f'Rule "{name}" needs a condition in "when"')
+        if not isinstance(self.actions, dict) or not self.actions:
+            raise RuleError(f'Rule "{name}" needs control messages by area in "do"')
+        try:
+            tree = ast.parse(self.condition, mode='eval')
+        except SyntaxError as e:
+            raise RuleError(f'Rule "{name}": {e.msg} in "{self.condition}"') from None
+        readings = _Readings()
+        tree = ast.fix_missing_locations(readings.visit(tree))
+        self.keys = readings.keys
+        self._code = compile(tree, f'<rule {name}>', 'eval')
+        self.active = False
+        self.fired = 0
+        self.fired_at = None
+
+    def evaluate(self, readings: dict, now: float) -> bool:
+        # Returns True when the rule fires
+        try:
+            active = bool(eval(self._code, {'__builtins__': {}}, {'_readings': readings}))
+        except (KeyError, ZeroDivisionError):
+            # A sensor it depends on did not report yet
+            active = False
+        fire = active and (not self.active or (self.repeat is not None and now - self.fired_at >= self.repeat))
+        self.active = active
+        if fire:
+            self.fired += 1
+            self.fired_at = now
+        return fire
+
+    @property
+    def state(self):
+        return dict(when=self.condition, fired=self.fired, fired_at=self.fired_at)
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .stream import SampleRing, encode_frame
+
+DEFAULT_RATE = 1 / 0.06
+DEFAULT_STREAM_RATE = 200
+DEFAULT_STREAM_FRAME = 20
+
+_executors = {}
+_bus_locks = {}
+
+
+def get_executor(bus: str) -> ThreadPoolExecutor:
+    # One worker per bus: reads on the same bus are serialised anyway, and a slow bus only
+    # delays the sensors attached to it.
+    executor = _executors.get(bus)
+    if executor is None:
+        executor = _executors[bus] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'sampler-{bus}')
+    return executor
+
+
+def get_bus_lock(bus: str) -> threading.Lock:
+    lock = _bus_locks.get(bus)
+    if lock is None:
+        lock = _bus_locks.setdefault(bus, threading.Lock())
+    return lock
+
+
+def _locked_read(lock, read):
+    with lock:
+        return read()
+
+
+def sample_rate(details: dict) -> float:
+    return float(details.get('rate', DEFAULT_RATE))
+
+
+def stream_settings(details: dict) -> dict:
+    settings = details.get('stream') or {}
+    return dict(enabled=bool(settings.get('enabled', False)), rate=float(settings.get('rate', DEFAULT_STREAM_RATE)),
+                frame=int(settings.get('frame', DEFAULT_STREAM_FRAME)))
+
+
+def sampler(read, callback, bus='default'):
+    """Returns a coroutine function for the scheduler that calls read() on the bus worker thread
+    and callback(value) back on the loop. Simulated sensors, on a loop with virtual time, are read inline."""
+    executor = get_executor(bus)
+    lock = get_bus_lock(bus)
+
+    async def sample():
+        loop = asyncio.get_running_loop()
+        if getattr(loop, 'virtual_time', False):
+            value = read()
+        else:
+            value = await loop.run_in_executor(executor, _locked_read, lock, read)
+        callback(value)
+
+    return sample
+
+
+class StreamSampler(threading.Thread):
+    """Samples an xyz sensor at a high rate into a ring and hands packed frames of
+    `frame_size` samples to publish(frame) on the event loop."""
+
+    def __init__(self, name, read, rate, frame_size, publish, loop, bus='default'):
+        super().__init__(name=f'stream-{name}', daemon=True)
+        self.sensor_name = name
+        self.read = read
+        self.rate = rate
+        self.frame_size = frame_size
+        self.publish = publish
+        self.loop = loop
+        self.bus = bus
+        self.ring = SampleRing(frame_size * 4)
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        lock = get_bus_lock(self.bus)
+        interval = 1.0 / self.rate
+        pending = 0
+        deadline = time.perf_counter()
+        while not self._stopped.is_set():
+            with lock:
+                x, y, z = self.read()
+            self.ring.append(time.time(), x, y, z)
+            pending += 1
+            if pending == self.frame_size:
+                pending = 0
+                self.loop.call_soon_threadsafe(self.publish, encode_frame(self.sensor_name, self.ring.last(self.frame_size)))
+            deadline += interval
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.perf_counter()
@@ -0,0 +1,95 @@
+import asyncio
+import inspect
+import traceback
+
+
+class TaskStatistics:
+    def __init__(self):
+        self.runs = 0
+        self.overruns = 0
+        self.errors = 0
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
+        self.duration_max = 0.0
+
+    def record(self, jitter, duration, overrun):
+        self.runs += 1
+        self.jitter_total += jitter
+        self.jitter_max = max(self.jitter_max, jitter)
+        self.duration_max = max(self.duration_max, duration)
+        if overrun:
+            self.overruns += 1
+
+    def as_dict(self):
+        return dict(runs=self.runs, overruns=self.overruns, errors=self.errors, jitter_max=self.jitter_max,
+                    jitter_mean=self.jitter_total / self.runs if self.runs else 0.0, duration_max=self.duration_max)
+
+
+class PeriodicTask:
+    """Calls callback() every `interval` seconds on fixed deadlines, so the time the callback takes
+    does not make the period drift. The callback may be a coroutine function. A parked task does
+    not wake up until wake() is called. An exception in the callback is printed and counted, and
+    the task carries on with the next period."""
+
+    def __init__(self, name, interval, callback):
+        self.name = name
+        self.interval = interval
+        self.callback = callback
+        self.statistics = TaskStatistics()
+        self.parked = False
+        self._woken = asyncio.Event()
+        self._task = None
+
+    def park(self):
+        self.parked = True
+        self._woken.clear()
+
+    def wake(self):
+        self.parked = False
+        self._woken.set()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            if self.parked:
+                await self._woken.wait()
+                deadline = loop.time()
+            started = loop.time()
+            jitter = started - deadline
+            try:
+                result = self.callback()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                # E.g. a transient bus error must not stop sampling for good
+                traceback.print_exc()
+                self.statistics.errors += 1
+            finished = loop.time()
+            deadline += self.interval
+            overrun = finished > deadline
+            if overrun:
+                # Skip the periods that were missed rather than running them back to back
+                deadline += ((finished - deadline) // self.interval + 1) * self.interval
+            self.statistics.record(jitter, finished - started, overrun)
+            await asyncio.sleep(deadline - loop.time())
+
+
+class Scheduler:
+    def __init__(self):
+        self.tasks = {}
+
+    def every(self, name, interval, callback) -> PeriodicTask:
+        task = self.tasks[name] = PeriodicTask(name, interval, callback).start()
+        return task
+
+    def statistics(self):
+        return {name: task.statistics.as_dict() for name, task in self.tasks.items()}
@@ -0,0 +1,231 @@
+import math
+import random
+from .clock import VirtualClock
+from .client import Robot
+from .controllers import *
+from .mqtt import ControllerHost
+from .transport import LocalTransport
+
+CONTROLLERS = (MotorController, ServoController, DistanceSensorController, LEDController, LineSensorController,
+               MagnetometerController, AccelerometerController, RulesController)
+
+
+class World:
+    """Differential drive robot in an empty rectangular room. x points east and y north, in metres,
+    the heading is in radians clockwise from north. Motor speeds go from -1 to 1."""
+
+    def __init__(self, clock, width=4.0, depth=3.0, x=None, y=None, heading=0.0, wheel_base=0.12, max_speed=0.3,
+                 field=(0.0, 20.0, -40.0), hard_iron=(8.0, -5.0, 2.0), noise=0.2, seed=0):
+        self.clock = clock
+        self.width = width
+        self.depth = depth
+        self.x = width / 2 if x is None else x
+        self.y = depth / 2 if y is None else y
+        self.heading = heading
+        self.wheel_base = wheel_base
+        self.max_speed = max_speed
+        # Earth field in µT (east, north, up) and the offset the robot itself adds to it
+        self.field = field
+        self.hard_iron = hard_iron
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.speeds = {'left': 0.0, 'right': 0.0}
+        self._updated = clock.monotonic()
+
+    def update(self):
+        now = self.clock.monotonic()
+        dt = now - self._updated
+        self._updated = now
+        if dt <= 0:
+            return
+        left = self.speeds['left'] * self.max_speed
+        right = self.speeds['right'] * self.max_speed
+        velocity = (left + right) / 2
+        turn = (left - right) / self.wheel_base
+        heading = self.heading + turn * dt / 2
+        # The walls stop the robot, it does not bounce
+        self.x = min(max(self.x + velocity * dt * math.sin(heading), 0.0), self.width)
+        self.y = min(max(self.y + velocity * dt * math.cos(heading), 0.0), self.depth)
+        self.heading = (self.heading + turn * dt) % (2 * math.pi)
+
+    def set_speed(self, side, value):
+        self.update()
+        self.speeds[side] = value
+
+    def _noise(self, scale=1.0):
+        return self.random.gauss(0.0, self.noise * scale)
+
+    def magnetic(self):
+        # The field in the body frame: x to the right, y forward, z up
+        self.update()
+        east, north, up = self.field
+        sin, cos = math.sin(self.heading), math.cos(self.heading)
+        x = east * cos - north * sin
+        y = east * sin + north * cos
+        return tuple(value + offset + self._noise() for value, offset in zip((x, y, up), self.hard_iron))
+
+    def acceleration(self):
+        self.update()
+        return self._noise(0.1), self._noise(0.1), 9.81 + self._noise(0.1)
+
+    def distance(self, max_distance):
+        # Distance straight ahead to the nearest wall
+        self.update()
+        dx, dy = math.sin(self.heading), math.cos(self.heading)
+        distances = [max_distance]
+        if dx > 1e-9:
+            distances.append((self.width - self.x) / dx)
+        elif dx < -1e-9:
+            distances.append(-self.x / dx)
+        if dy > 1e-9:
+            distances.append((self.depth - self.y) / dy)
+        elif dy < -1e-9:
+            distances.append(-self.y / dy)
+        return max(min(distances) + self._noise(0.005), 0.0)
+
+
+class SimulatedMotor:
+    def __init__(self, world, side):
+        self.world = world
+        self.side = side
+
+    @property
+    def value(self):
+        return self.world.speeds[self.side]
+
+    @value.setter
+    def value(self, value):
+        self.world.set_speed(self.side, value)
+
+
+class SimulatedDistanceSensor:
+    def __init__(self, world, max_distance):
+        self.world = world
+        self.max_distance = max_distance
+
+    @property
+    def distance(self):
+        return self.world.distance(self.max_distance)
+
+
+class SimulatedMagnetometer:
+    def __init__(self, world):
+        self.world = world
+
+    @property
+    def magnetic(self):
+        return self.world.magnetic()
+
+
+class SimulatedAccelerometer:
+    def __init__(self, world):
+        self.world = world
+
+    @property
+    def acceleration(self):
+        return self.world.acceleration()
+
+
+class SimulatedLineSensor:
+    # The room has no lines
+    value = 0
+
+
+class SimulatedPixelStrip:
+    def __init__(self, count, brightness):
+        self.brightness = brightness
+        self.pixels = [None] * count
+        self.shows = 0
+
+    def getBrightness(self):
+        return self.brightness
+
+    def setBrightness(self, brightness):
+        self.brightness = brightness
+
+    def setPixelColor(self, index, color):
+        self.pixels[index] = color
+
+    def begin(self):
+        pass
+
+    def show(self):
+        self.shows += 1
+
+
+class SimulatedPWM:
+    def __init__(self):
+        self.registers = bytearray(256)
+
+    def readU8(self, register):
+        return self.registers[register]
+
+    def write8(self, register, value):
+        self.registers[register] = value
+
+    def writeList(self, register, data):
+        self.registers[register:register + len(data)] = bytes(data)
+
+
+def install(controller, config, world):
+    # Swaps the hardware, or the stand-ins for it, of a controller for simulated hardware driven by world
+    if isinstance(controller, MotorController):
+        controller.motors = {name: SimulatedMotor(world, name) for name in controller.motors}
+    elif isinstance(controller, DistanceSensorController):
+        controller.sensors = {name: SimulatedDistanceSensor(world, config['distancesensors'][name]['max_distance'])
+                              for name in controller.sensors}
+    elif isinstance(controller, MagnetometerController):
+        controller.magnetometers = {name: SimulatedMagnetometer(world) for name in controller.magnetometers}
+    elif isinstance(controller, AccelerometerController):
+        controller.accelerometers = {name: SimulatedAccelerometer(world) for name in controller.accelerometers}
+    elif isinstance(controller, LineSensorController):
+        controller.sensors = {name: SimulatedLineSensor() for name in controller.sensors}
+    elif isinstance(controller, LEDController):
+        controller.controller = SimulatedPixelStrip(config['leds']['count'], controller.controller.getBrightness())
+        for led in controller.leds.values():
+            led.parent = controller.controller
+    elif isinstance(controller, ServoController):
+        controller.output.device = SimulatedPWM()
+
+
+class Simulation:
+    """The controllers of srcontroller on simulated hardware and a virtual clock, e.g.
+
+        simulation = Simulation(utils.load("config/robot.yaml"))
+        robot = simulation.robot()
+        robot.forward(50)
+        robot.clock.sleep(2)
+        print(simulation.world.y)
+
+    Runs as fast as the code allows and gives the same results for the same seed. Sensor streams
+    are not simulated.
+    """
+
+    def __init__(self, config, seed=0, clock=None, **world):
+        self.clock = clock if clock is not None else VirtualClock()
+        self.world = World(self.clock, seed=seed, **world)
+        self.transport = LocalTransport()
+        self.controllers = [ctrl(config) for ctrl in CONTROLLERS]
+        for controller in self.controllers:
+            install(controller, config, self.world)
+        self.host = ControllerHost(self.controllers, self.transport)
+        self._task = self.clock.loop.create_task(self.host.run())
+
+    def robot(self, **kwargs) -> Robot:
+        # A connected threaded client, observers are called straight away to keep the run deterministic
+        kwargs.setdefault('observers', 'sync')
+        robot = Robot(transport=self.transport, clock=self.clock, **kwargs)
+        robot.connect()
+        return robot
+
+    def statistics(self):
+        return self.host.scheduler.statistics()
+
+    def close(self):
+        # The host only starts once the clock runs, e.g. when no robot connected
+        self.clock.run(self.host.ready.wait())
+        for task in self.host.scheduler.tasks.values():
+            task.cancel()
+        self.transport.stop()
+        self.clock.run(self._task)
+        self.clock.close()
@@ -0,0 +1,92 @@
+import asyncio
+import importlib
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from .mqtt import ControllerHost
+from .utils import topic_prefix
+
+# Configuration section: module and class of its controller
+CONTROLLERS = {
+    'motors': ('simplerobot.controllers.motor', 'MotorController'),
+    'servos': ('simplerobot.controllers.servo', 'ServoController'),
+    'distancesensors': ('simplerobot.controllers.distancesensor', 'DistanceSensorController'),
+    'leds': ('simplerobot.controllers.led', 'LEDController'),
+    'linesensors': ('simplerobot.controllers.linesensor', 'LineSensorController'),
+    'magnetometers': ('simplerobot.controllers.magnetometer', 'MagnetometerController'),
+    'accelerometers': ('simplerobot.controllers.accelerometer', 'AccelerometerController'),
+    'rules': ('simplerobot.controllers.rules', 'RulesController'),
+}
+
+
+class StartupPipeline:
+    """Builds the controllers of the sections in the configuration, each on a thread of its own, and
+    adds every controller to the host as soon as it is built. The host connects in the meantime,
+    so a slow or failing controller does not keep the others from serving.
+
+    timings holds, per controller, how long importing its module, building it (which loads the
+    drivers and probes the hardware) and attaching it took, and when it was serving relative to
+    the start.
+    """
+
+    def __init__(self, config: dict, host: ControllerHost = None, slow_after=5.0):
+        self.config = config
+        self.host = host if host is not None else ControllerHost(prefix=topic_prefix(config))
+        self.slow_after = slow_after
+        self.sections = [section for section in CONTROLLERS if section in config]
+        self.timings = {}
+        self._started = None
+
+    def _build(self, section):
+        # On a worker thread
+        module_name, class_name = CONTROLLERS[section]
+        started = time.perf_counter()
+        controller_class = getattr(importlib.import_module(module_name), class_name)
+        imported = time.perf_counter()
+        controller = controller_class(self.config)
+        return controller, imported - started, time.perf_counter() - imported
+
+    async def _start(self, executor, section):
+        loop = asyncio.get_running_loop()
+        try:
+            controller, import_time, build_time = await loop.run_in_executor(executor, self._build, section)
+        except Exception as e:
+            traceback.print_exc()
+            self.timings[section] = dict(error=repr(e), failed_after=time.perf_counter() - self._started)
+            print(f'startup: {section} failed: {e!r}')
+            return
+        await self.host.ready.wait()
+        attaching = time.perf_counter()
+        self.host.add(controller)
+        finished = time.perf_counter()
+        self.timings[section] = dict(imported=import_time, built=build_time, attached=finished - attaching,
+                                     serving_after=finished - self._started)
+        print(f'startup: {section} import {import_time * 1000:.1f} ms, build {build_time * 1000:.1f} ms, '
+              f'attach {(finished - attaching) * 1000:.1f} ms, serving after {(finished - self._started) * 1000:.1f} ms')
+
+    async def _connected(self):
+        await self.host.ready.wait()
+        connect_time = time.perf_counter() - self._started
+        self.timings['connect'] = connect_time
+        print(f'startup: serving control messages after {connect_time * 1000:.1f} ms')
+
+    async def run(self):
+        self._started = time.perf_counter()
+        asyncio.create_task(self._connected())
+        executor = ThreadPoolExecutor(max_workers=max(len(self.sections), 1), thread_name_prefix='startup')
+        host = asyncio.create_task(self.host.run())
+        starting = asyncio.gather(*(self._start(executor, section) for section in self.sections))
+        done, _ = await asyncio.wait({host, starting}, timeout=self.slow_after, return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            waiting = [section for section in self.sections if section not in self.timings]
+            print(f'startup: still initialising after {self.slow_after} s: {", ".join(waiting)}')
+            await asyncio.wait({host, starting}, return_when=asyncio.FIRST_COMPLETED)
+        if host.done():
+            # The connection failed or closed, nothing left to start for
+            starting.cancel()
+            executor.shutdown(wait=False)
+            await host
+            return
+        print(f'startup: done in {(time.perf_counter() - self._started) * 1000:.1f} ms')
+        executor.shutdown(wait=False)
+        await host
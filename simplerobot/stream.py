@@ -0,0 +1,43 @@
+import struct
+
+MAGIC = 0x53
+HEADER = struct.Struct('<BBH')  # magic, name length, sample count
+RECORD = struct.Struct('<dfff')  # timestamp, x, y, z
+
+
+class StreamError(Exception):
+    pass
+
+
+class SampleRing:
+    # Samples are stored already packed as frame records, so a frame is a copy of a slice
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._buffer = bytearray(RECORD.size * capacity)
+        self._index = 0
+
+    def append(self, timestamp, x, y, z):
+        RECORD.pack_into(self._buffer, self._index * RECORD.size, timestamp, x, y, z)
+        self._index = (self._index + 1) % self.capacity
+
+    def last(self, count: int) -> bytes:
+        if count > self.capacity:
+            raise StreamError(f'Only the last {self.capacity} samples are kept')
+        start = (self._index - count) % self.capacity
+        if start + count <= self.capacity:
+            return bytes(self._buffer[start * RECORD.size:(start + count) * RECORD.size])
+        return bytes(self._buffer[start * RECORD.size:]) + bytes(self._buffer[:self._index * RECORD.size])
+
+
+def encode_frame(name: str, records: bytes) -> bytes:
+    encoded_name = name.encode()
+    return HEADER.pack(MAGIC, len(encoded_name), len(records) // RECORD.size) + encoded_name + records
+
+
+def decode_frame_header(payload: bytes):
+    # Returns the sensor name, the number of samples and the offset of the first record
+    magic, name_length, count = HEADER.unpack_from(payload)
+    if magic != MAGIC:
+        raise StreamError('Not a stream frame')
+    offset = HEADER.size + name_length
+    return bytes(payload[HEADER.size:offset]).decode(), count, offset
@@ -0,0 +1,58 @@
+import numpy
+
+
+class TrajectoryPlanner:
+    """Minimum jerk trajectories for a set of joints, all evaluated together from wall-clock time.
+
+    Velocity and acceleration are zero at both ends of a move. The requested speed is the average
+    speed of the move, so a move takes as long as at a constant speed; the peak velocity, in the
+    middle of the move, is 1.875 times that. Positions only depend on the time they are evaluated at,
+    so a late update jumps to where the joint should be instead of stretching the move.
+    """
+
+    def __init__(self, count: int):
+        self.position = numpy.zeros(count)
+        self.start = numpy.zeros(count)
+        self.target = numpy.zeros(count)
+        self.start_time = numpy.zeros(count)
+        self.duration = numpy.zeros(count)
+        self.active = numpy.zeros(count, dtype=bool)
+
+    def reset(self, slot: int, position: float):
+        self.position[slot] = self.start[slot] = self.target[slot] = position
+        self.active[slot] = False
+
+    def move(self, slots, targets, speeds, now: float, synchronise=False):
+        # speeds in units per second; with synchronise all the joints arrive together at the pace of the slowest
+        self.update(now)
+        slots = numpy.asarray(slots, dtype=int)
+        targets = numpy.asarray(targets, dtype=float)
+        speeds = numpy.asarray(speeds, dtype=float)
+        start = self.position[slots]
+        distance = numpy.abs(targets - start)
+        duration = numpy.divide(distance, speeds, out=numpy.zeros_like(distance), where=speeds > 0)
+        if synchronise and len(duration):
+            duration[:] = duration.max()
+
+        self.start[slots] = start
+        self.target[slots] = targets
+        self.start_time[slots] = now
+        self.duration[slots] = duration
+        moving = (distance > 0) & (duration > 0)
+        self.active[slots] = moving
+        # Moves without a duration happen straight away
+        jumps = slots[~moving]
+        self.position[jumps] = self.target[jumps]
+
+    def update(self, now: float):
+        slots = numpy.flatnonzero(self.active)
+        if not len(slots):
+            return slots
+        tau = numpy.clip((now - self.start_time[slots]) / self.duration[slots], 0.0, 1.0)
+        progress = tau * tau * tau * (10.0 + tau * (-15.0 + 6.0 * tau))
+        start = self.start[slots]
+        self.position[slots] = start + (self.target[slots] - start) * progress
+        finished = slots[tau >= 1.0]
+        self.position[finished] = self.target[finished]
+        self.active[finished] = False
+        return slots
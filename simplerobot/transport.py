@@ -0,0 +1,92 @@
+import asyncio
+import threading
+from .utils import copy_state
+
+
+class LocalTransport:
+    """Connects controllers and clients that run in the same process, without a broker or codec.
+
+    State is handed to the clients as dicts and control messages to the controllers as the dicts
+    the client built, e.g.
+
+        transport = LocalTransport()
+        threading.Thread(target=asyncio.run, args=(ControllerHost(controllers, transport).run(),)).start()
+        robot = Robot(transport=transport)
+        robot.connect()
+
+    Control messages are handled on the loop of the controllers. State is delivered to a threaded
+    Robot on the thread that published it, one message at a time, and to an AsyncRobot on its loop.
+    """
+
+    def __init__(self):
+        self.components = {}
+        self.host = None
+        self.loop = None
+        self._clients = []
+        self._lock = threading.Lock()
+        self._stopped = None
+
+    # Controller side
+
+    async def serve(self, host):
+        self.loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        self.host = host
+        # The host may add components later on
+        self.components = host.components
+        host.start_components(self)
+        host.ready.set()
+        await self._stopped.wait()
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._stopped.set)
+
+    def publish_state(self, component, message: dict, retain, thread_safe=False):
+        self._deliver(component.name, message, False)
+
+    def publish_stream(self, component, frame: bytes):
+        self._deliver(component.name, frame, True)
+
+    def publish_metrics(self, component, metrics: dict):
+        # Clients do not receive metrics, they are read with ControllerHost.metrics()
+        pass
+
+    def _deliver(self, area, message, stream):
+        with self._lock:
+            # Clients keep and update the dicts they receive, so every client gets its own copy; the
+            # controllers may hand over their live state
+            messages = [message if stream else copy_state(message) for _ in self._clients]
+            for (robot, loop), message in zip(self._clients, messages):
+                handler = robot._on_stream if stream else robot._handle_message
+                if loop is None:
+                    handler(area, message)
+                else:
+                    loop.call_soon_threadsafe(handler, area, message)
+
+    # Client side
+
+    def connect(self, robot, loop=None):
+        # loop is the event loop of an asyncio client, None for a threaded one
+        with self._lock:
+            self._clients.append((robot, loop))
+        if self.loop is not None:
+            # The stand-in for the retained state, the current state of every controller
+            self.loop.call_soon_threadsafe(self._send_state, robot, loop)
+
+    def disconnect(self, robot):
+        with self._lock:
+            self._clients = [client for client in self._clients if client[0] is not robot]
+
+    def _send_state(self, robot, loop):
+        for name, component in self.components.items():
+            if loop is None:
+                with self._lock:
+                    robot._handle_message(name, copy_state(component.state))
+            else:
+                loop.call_soon_threadsafe(robot._handle_message, name, copy_state(component.state))
+
+    def send_control(self, area: str, message: dict):
+        component = self.components.get(area)
+        if component is not None:
+            self.loop.call_soon_threadsafe(self.host.handle, component, message)
@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import defaultdict
+
+_tracking = threading.local()
+
+
+def record_access(obj, prop):
+    # Called by CachedStateObject for every state property read
+    dependencies = getattr(_tracking, 'dependencies', None)
+    if dependencies is not None:
+        dependencies.add((obj, prop))
+
+
+class Trigger:
+    """Calls callback() each time predicate() becomes true (or only the first time with once)."""
+
+    def __init__(self, index, predicate, callback, once=False):
+        self.index = index
+        self.predicate = predicate
+        self.callback = callback
+        self.once = once
+        self.active = False
+        self.dependencies = frozenset()
+        self.fired = 0
+        self.latency = None
+        self.max_latency = 0.0
+
+    def cancel(self):
+        self.index.remove(self)
+
+    def evaluated(self, result, received):
+        fire = result and not self.active
+        self.active = result
+        if fire:
+            self.callback()
+            # Time from the state message arriving to the end of the action
+            self.latency = time.monotonic() - received
+            self.max_latency = max(self.max_latency, self.latency)
+            self.fired += 1
+        return fire
+
+
+class TriggerIndex:
+    """Triggers indexed by the (object, property) pairs their predicate read the last time it was
+    evaluated, so an update only evaluates the predicates that depend on it."""
+
+    def __init__(self):
+        self._by_dependency = defaultdict(set)
+        self._untracked = set()
+        self._lock = threading.RLock()
+
+    def add(self, predicate, callback, once=False) -> Trigger:
+        trigger = Trigger(self, predicate, callback, once)
+        with self._lock:
+            self._evaluate(trigger, time.monotonic())
+        return trigger
+
+    def remove(self, trigger: Trigger):
+        with self._lock:
+            self._index(trigger, frozenset())
+            self._untracked.discard(trigger)
+
+    def updated(self, changes, received: float):
+        with self._lock:
+            if not self._by_dependency and not self._untracked:
+                return
+            triggers = set(self._untracked)
+            for change in changes:
+                triggers.update(self._by_dependency.get(change, ()))
+            for trigger in triggers:
+                self._evaluate(trigger, received)
+
+    def _index(self, trigger, dependencies):
+        for dependency in trigger.dependencies - dependencies:
+            triggers = self._by_dependency[dependency]
+            triggers.discard(trigger)
+            if not triggers:
+                del self._by_dependency[dependency]
+        for dependency in dependencies - trigger.dependencies:
+            self._by_dependency[dependency].add(trigger)
+        trigger.dependencies = dependencies
+
+    def _evaluate(self, trigger, received):
+        _tracking.dependencies = dependencies = set()
+        try:
+            result = bool(trigger.predicate())
+        except (KeyError, AttributeError):
+            # Objects the predicate needs have not been received yet
+            result = False
+        finally:
+            _tracking.dependencies = None
+        self._index(trigger, frozenset(dependencies))
+        if dependencies:
+            self._untracked.discard(trigger)
+        else:
+            self._untracked.add(trigger)
+        if trigger.evaluated(result, received) and trigger.once:
+            self.remove(trigger)
@@ -1,6 +1,7 @@
 from yaml import safe_load
 from urllib.parse import urlparse
 import numpy
+import os
 
 
 def load(filename):
@@ -31,6 +32,37 @@ def get_mqtt_connection_details(url):
     return host, kwargs
 
 
+def topic_prefix(config: dict = None) -> str:
+    # The first level of the topics of a robot, so several robots can share a broker
+    return os.environ.get('SIMPLEROBOT_PREFIX', (config or {}).get('prefix', 'robot'))
+
+
+def copy_state(state: dict) -> dict:
+    return {key: copy_state(value) if isinstance(value, dict) else value for key, value in state.items()}
+
+
+def state_delta(old: dict, new: dict) -> dict:
+    delta = {}
+    for key, value in new.items():
+        previous = old.get(key)
+        if isinstance(value, dict) and isinstance(previous, dict):
+            changed = state_delta(previous, value)
+            if changed:
+                delta[key] = changed
+        elif key not in old or value != previous:
+            delta[key] = copy_state(value) if isinstance(value, dict) else value
+    return delta
+
+
+def merge_state(state: dict, delta: dict):
+    for key, value in delta.items():
+        previous = state.get(key)
+        if isinstance(value, dict) and isinstance(previous, dict):
+            merge_state(previous, value)
+        else:
+            state[key] = copy_state(value) if isinstance(value, dict) else value
+
+
 class MovingAverage:
     def __init__(self, window_size):
         self._count = 0
@@ -46,8 +78,71 @@ class MovingAverage:
 
     @property
     def is_valid(self):
-        return self._count > self.window_size
+        return self._count >= self.window_size
 
     @property
     def average(self):
         return numpy.mean(self._array)
+
+
+class FilterBank:
+    """Filters a vector of `width` channels (e.g. x, y, z) per update.
+
+    Modes:
+      mean   - moving average over the window, O(1) per update from a running sum
+      ema    - exponential moving average with factor alpha
+      median - moving median over the window; with outlier_threshold set, a channel further than
+               that many median absolute deviations from the median is replaced by the median
+    """
+    MODES = ('mean', 'ema', 'median')
+
+    def __init__(self, width, window_size=10, mode='mean', alpha=None, outlier_threshold=None):
+        if mode not in FilterBank.MODES:
+            raise ValueError(f'Unknown filter mode "{mode}"')
+        self.width = width
+        self.window_size = window_size
+        self.mode = mode
+        self.alpha = alpha if alpha is not None else 2.0 / (window_size + 1)
+        self.outlier_threshold = outlier_threshold
+        self._window = numpy.zeros((window_size, width))
+        self._sum = numpy.zeros(width)
+        self._value = numpy.zeros(width)
+        self._offset = 0
+        self._count = 0
+
+    def add(self, values):
+        values = numpy.asarray(values, dtype=float)
+        if self.mode == 'median' and self.outlier_threshold is not None and self._count:
+            deviation = numpy.abs(values - self._value)
+            mad = numpy.median(numpy.abs(self._filled() - self._value), axis=0)
+            values = numpy.where((mad > 0) & (deviation > self.outlier_threshold * mad), self._value, values)
+
+        self._sum += values - self._window[self._offset]
+        self._window[self._offset] = values
+        if self._count < self.window_size:
+            self._count += 1
+        self._offset = (self._offset + 1) % self.window_size
+        if self._offset == 0:
+            # Resynchronise the running sum once per window so rounding errors cannot build up
+            self._sum = self._window.sum(axis=0)
+
+        if self.mode == 'mean':
+            numpy.divide(self._sum, self._count, out=self._value)
+        elif self.mode == 'ema':
+            if self._count == 1:
+                self._value[:] = values
+            else:
+                self._value += self.alpha * (values - self._value)
+        else:
+            self._value[:] = numpy.median(self._filled(), axis=0)
+
+    def _filled(self):
+        return self._window if self._count == self.window_size else self._window[:self._count]
+
+    @property
+    def is_valid(self):
+        return self._count >= self.window_size
+
+    @property
+    def value(self):
+        return self._value
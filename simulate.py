@@ -0,0 +1,27 @@
+import sys
+import tempfile
+import time
+from explorer import Explorer
+from simplerobot import utils
+from simplerobot.compass import CalibrationStore
+from simplerobot.simulation import Simulation
+
+# Runs the Explorer against simulated hardware: python simulate.py [simulated seconds] [seed]
+
+
+def main(duration=30.0, seed=0):
+    simulation = Simulation(utils.load("config/robot.yaml"), seed=seed)
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as directory:
+        robot = simulation.robot()
+        explorer = Explorer(robot, CalibrationStore(f'{directory}/compass.json'))
+        explorer.run(duration)
+    elapsed = time.perf_counter() - started
+    world = simulation.world
+    print(f'x {world.x:.3f} y {world.y:.3f} heading {world.heading:.3f} bearing {explorer.compass.bearing}')
+    simulation.close()
+    print(f'{simulation.clock.monotonic():.1f} s simulated in {elapsed:.2f} s, {simulation.clock.monotonic() / elapsed:.0f}x')
+
+
+if __name__ == '__main__':
+    main(*(float(argument) for argument in sys.argv[1:2]), *(int(argument) for argument in sys.argv[2:3]))
@@ -1,17 +1,14 @@
 import asyncio
+import time
 from simplerobot import utils
-from simplerobot.controllers import *
+from simplerobot.startup import StartupPipeline
 
 
 async def main():
+    started = time.perf_counter()
     config = utils.load("config/robot.yaml")
-    controllers = [ctrl(config) for ctrl in (MotorController, ServoController, DistanceSensorController,
-                   LEDController, LineSensorController, MagnetometerController, AccelerometerController)]
-    for controller in controllers:
-        asyncio.create_task(controller.start())
-
-    while True:
-        await asyncio.sleep(60)
+    print(f'startup: configuration loaded in {(time.perf_counter() - started) * 1000:.1f} ms')
+    await StartupPipeline(config).run()
 
 if __name__ == '__main__':
     asyncio.run(main())